@@ -1,14 +1,25 @@
 import base64
 import hashlib
+import json
 import re
 import calendar
+import copy
 import html
+import os
+import queue
 import shutil
+import sqlite3
+import threading
 import time
 import uuid
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from pathlib import Path
 from urllib.parse import urljoin, urlparse
 from datetime import date, datetime
-from typing import Any
+from itertools import islice
+from typing import Any, Iterator
 
 import requests
 
@@ -20,6 +31,8 @@ import streamlit as st
 from google.oauth2.service_account import Credentials
 from PIL import Image, ImageEnhance, ImageFilter, ImageOps
 
+from shared_state import shared
+
 try:
     import pytesseract
 except Exception as exc:
@@ -28,6 +41,14 @@ except Exception as exc:
 else:
     PYTESSERACT_IMPORT_ERROR = None
 
+try:
+    import tesserocr
+except Exception as exc:
+    tesserocr = None
+    TESSEROCR_IMPORT_ERROR = exc
+else:
+    TESSEROCR_IMPORT_ERROR = None
+
 try:
     from pyzbar.pyzbar import ZBarSymbol, decode as pyzbar_decode
 except Exception as exc:
@@ -37,6 +58,26 @@ except Exception as exc:
 else:
     PYZBAR_IMPORT_ERROR = None
 
+try:
+    import zxingcpp
+except Exception as exc:
+    zxingcpp = None
+    ZXINGCPP_IMPORT_ERROR = exc
+else:
+    ZXINGCPP_IMPORT_ERROR = None
+
+try:
+    from pylibdmtx.pylibdmtx import decode as pylibdmtx_decode
+except Exception as exc:
+    pylibdmtx_decode = None
+    PYLIBDMTX_IMPORT_ERROR = exc
+else:
+    PYLIBDMTX_IMPORT_ERROR = None
+
+if int(pd.__version__.split(".")[0]) < 3:
+    # Shared ledger frames are handed out as shallow copies; pandas >= 3 always copies on write.
+    pd.set_option("mode.copy_on_write", True)
+
 SCOPE = ["https://www.googleapis.com/auth/spreadsheets", 
         "https://www.googleapis.com/auth/drive" ,
         ]
@@ -48,9 +89,30 @@ CATEGORIES = ["Φάρμακο", "Συμπλήρωμα", "Καλλυντικό",
 GREEK_PROVIDER_TIMEOUT_SECONDS = 4
 GREEK_PROVIDER_CACHE_TTL_SECONDS = 600
 BACK_OCR_TIMEOUT_SECONDS = 8
+TESSEROCR_POOL_SIZE = max(1, min(4, os.cpu_count() or 1))
 MAX_FRONT_OCR_CALLS = 0
 MAX_BACK_EXPIRY_OCR_CALLS = 4
+MAX_EXPIRY_REGION_OCR_CALLS = 4
+# Region crops and full-image passes together, within one deadline.
+MAX_BACK_EXPIRY_TOTAL_OCR_CALLS = 6
+BACK_EXPIRY_OCR_DEADLINE_SECONDS = 12
+EXPIRY_REGION_MAX_SIDE = 1000
 MAX_BARCODE_DECODER_ATTEMPTS = 120
+# When detect_code may stop before the attempt cap; detect_code(early_exit=...) overrides single keys.
+BARCODE_EARLY_EXIT = {
+    "unambiguous_ean13": True,
+    "gs1_valid_gtin": True,
+    "agreeing_attempts": 2,
+}
+# pylibdmtx searches the whole image until this timeout when no DataMatrix is present.
+DATAMATRIX_TIMEOUT_MS = 250
+BARCODE_DECODERS = ("pyzbar", "opencv_barcode", "opencv_qr")
+BARCODE_DECODER_WORKERS = max(1, min(4, os.cpu_count() or 1))
+# Localization runs at this size: an EAN-13 spanning 6% of a 12 MP photo keeps ~0.8 px modules.
+BARCODE_REGION_MAX_SIDE = 1600
+BARCODE_MIN_CODE_FRACTION = 0.04
+BARCODE_PYRAMID_MAX_SIDE = 1000
+BARCODE_MAX_UPSCALE_SIDE = 1000
 MIN_VALID_EXPIRY_YEAR = 2020
 DEFAULT_STOCK_ADD_QUANTITY = 1
 
@@ -104,6 +166,10 @@ class SchemaError(InventoryError):
     pass
 
 
+class OcrEngineError(Exception):
+    """The OCR engine could not start (missing traineddata, bad tessdata path); unlike a timeout, retrying will not help."""
+
+
 def clean(value: Any) -> str:
     return str(value or "").strip()
 
@@ -209,24 +275,49 @@ def classify_barcode_value(code_type: str, value: str) -> dict[str, Any]:
     return result
 
 
+def detected_code_key(candidate: dict[str, Any]) -> str:
+    """The product a candidate identifies: GTINs zero-padded to 14 digits, so EAN-13 and GS1 reads compare equal."""
+    value = clean(candidate.get("gtin") or candidate.get("value"))
+    return value.zfill(14) if value.isdigit() and len(value) in {8, 12, 13, 14} else value
+
+
 def choose_detected_code(candidates: list[dict[str, Any]]) -> dict[str, Any]:
     valid = [c for c in candidates if c.get("valid")]
+    # Repeated reads of the same code are agreement, not ambiguity.
+    ambiguous = len({detected_code_key(c) for c in valid}) > 1
     for preferred in ("EAN-13", "EAN-8"):
         matches = [c for c in valid if c.get("type") == preferred]
         if matches:
             selected = matches[0].copy()
-            selected["ambiguous"] = len(valid) > 1
+            selected["ambiguous"] = ambiguous
             return selected
     gs1 = [c for c in valid if c.get("gtin")]
     if gs1:
         selected = gs1[0].copy()
-        selected["ambiguous"] = len(valid) > 1
+        selected["ambiguous"] = ambiguous
         return selected
     selected = (valid or candidates or [{"type": "Barcode", "value": "", "checksum": "missing", "valid": False}])[0].copy()
-    selected["ambiguous"] = len(valid) > 1
+    selected["ambiguous"] = ambiguous
     return selected
 
 
+def early_exit_reason(candidates: list[dict[str, Any]], policy: dict[str, Any] | None = None) -> str:
+    """Why the scan can stop now, or ""; only on choose_detected_code's unambiguous, check-digit-verified pick."""
+    policy = {**BARCODE_EARLY_EXIT, **(policy or {})}
+    selected = choose_detected_code(candidates)
+    if selected["ambiguous"] or not selected.get("valid") or selected.get("checksum") != "valid":
+        return ""
+    key = detected_code_key(selected)
+    agreeing = sum(1 for c in candidates if c.get("valid") and c.get("checksum") == "valid" and detected_code_key(c) == key)
+    if policy["unambiguous_ean13"] and selected.get("type") == "EAN-13":
+        return "unambiguous_ean13"
+    if policy["gs1_valid_gtin"] and selected.get("type") in {"QR", "DataMatrix"} and selected.get("gtin"):
+        return "gs1_valid_gtin"
+    if policy["agreeing_attempts"] and agreeing >= policy["agreeing_attempts"]:
+        return "agreeing_attempts"
+    return ""
+
+
 def validate_barcode_gtin(barcode: str = "", gtin: str = "") -> list[str]:
     warnings = []
     if clean(barcode) and not clean(barcode).isdigit():
@@ -263,6 +354,7 @@ def validate_and_migrate_headers(ws) -> tuple[list[str], list[str]]:
     headers = [clean(h) for h in ws.row_values(1)]
     if not headers or not any(headers):
         ws.update("A1", [COLUMNS])
+        _remember_headers(ws, COLUMNS.copy(), [])
         return COLUMNS.copy(), []
     if any(not h for h in headers):
         raise SchemaError(
@@ -293,6 +385,7 @@ def validate_and_migrate_headers(ws) -> tuple[list[str], list[str]]:
         headers = headers + missing
         ws.update("A1", [headers])
     unknown = [header for header in headers if header not in COLUMNS and header not in DEPRECATED_COLUMNS]
+    _remember_headers(ws, headers, unknown)
     return headers, unknown
 
 
@@ -334,25 +427,58 @@ def records_to_dataframe(records: list[dict[str, Any]]) -> pd.DataFrame:
     legacy_kind = df["MovementKind"].str.strip().eq("")
     df.loc[legacy_kind, "MovementKind"] = NORMAL
 
-    df["Προϊόν"] = df["Προϊόν"].map(lambda value: normalize_spaces(value).upper())
-    df["Μάρκα"] = df["Μάρκα"].map(lambda value: normalize_spaces(value).upper())
-    df["DosageForm"] = df["DosageForm"].map(lambda value: normalize_spaces(value).upper())
-    df["Strength"] = df["Strength"].map(normalize_strength)
+    df["Προϊόν"] = _map_unique(df["Προϊόν"], _normalize_upper)
+    df["Μάρκα"] = _map_unique(df["Μάρκα"], _normalize_upper)
+    df["DosageForm"] = _map_unique(df["DosageForm"], _normalize_upper)
+    df["Strength"] = _map_unique(df["Strength"], normalize_strength)
 
     df["DeltaQty"] = pd.to_numeric(df["DeltaQty"], errors="coerce").fillna(0).astype(int)
     df["LocationId"] = pd.to_numeric(df["LocationId"], errors="coerce").fillna(-1).astype(int)
-    df["Voided"] = df["Voided"].map(normalize_bool)
-    return df[COLUMNS]
+    df["Voided"] = _map_unique(df["Voided"], normalize_bool).astype(bool)
+    return compact_ledger(df[COLUMNS])
+
+
+def compact_ledger(df: pd.DataFrame) -> pd.DataFrame:
+    """Store low-cardinality text as categoricals, LocationId as the smallest int and Voided as bool."""
+    df = df.astype({column: "category" for column in LEDGER_CATEGORY_COLUMNS})
+    df["LocationId"] = pd.to_numeric(df["LocationId"], downcast="integer")
+    df["Voided"] = df["Voided"].astype(bool)
+    return df
+
+
+def _normalize_upper(value: Any) -> str:
+    return normalize_spaces(value).upper()
+
+
+def _map_unique(series: pd.Series, func) -> pd.Series:
+    # Product names, brands and flags repeat heavily, so normalize each distinct value once.
+    codes, uniques = pd.factorize(series.astype(object).fillna(""), use_na_sentinel=False)
+    mapped = np.asarray([func(value) for value in uniques], dtype=object)
+    return pd.Series(mapped[codes], index=series.index).infer_objects()
 
 
 GOOGLE_READ_CACHE_TTL_SECONDS = 15
+LEDGER_CATEGORY_COLUMNS = ["CodeType", "MovementKind", "Τοποθεσία", "Κατηγορία", "Κίνηση"]
+# Opt-in: the snapshot holds the whole ledger, photo data URLs included.
+LEDGER_SNAPSHOT_PATH: Path | None = Path(os.environ["APOTHIKI_LEDGER_SNAPSHOT"]) if os.environ.get("APOTHIKI_LEDGER_SNAPSHOT") else None
 GOOGLE_TEMPORARY_STATUS_CODES = {429, 500, 502, 503, 504}
-_GOOGLE_READ_CACHE: dict[int, dict[str, Any]] = {}
-_GOOGLE_DEBUG: dict[str, Any] = {
+# Caches and locks live in shared_state: Streamlit re-executes this script on every rerun.
+_GOOGLE_READ_CACHE: dict[int | str, dict[str, Any]] = shared("google_read_cache", dict)
+_LEDGER_SYNC_STATE: dict[int | str, dict[str, Any]] = shared("ledger_sync_state", dict)
+_HEADER_CACHE: dict[int | str, dict[str, Any]] = shared("header_cache", dict)
+_LEDGER_LOCKS: dict[int | str, threading.RLock] = shared("ledger_locks", dict)
+_LEDGER_LOCKS_GUARD: threading.Lock = shared("ledger_locks_guard", threading.Lock)
+LEDGER_VIEW_CACHE_SIZE = 8
+_LEDGER_VIEW_CACHE: dict[tuple, pd.DataFrame] = shared("ledger_view_cache", dict)
+_LEDGER_VIEW_LOCK: threading.Lock = shared("ledger_view_lock", threading.Lock)
+GOOGLE_DEBUG_DEFAULTS = {
     "cached": False,
     "read_attempts": 0,
     "last_temporary_error_type": "",
     "row_count": 0,
+    "sync_mode": "",
+    "tail_rows": 0,
+    "snapshot": "",
 }
 
 
@@ -360,8 +486,16 @@ def initialize_schema(ws) -> tuple[list[str], list[str]]:
     return validate_and_migrate_headers(ws)
 
 
-def _worksheet_cache_key(ws) -> int:
-    return id(ws)
+def _worksheet_cache_key(ws) -> int | str:
+    # The spreadsheet/worksheet ids are shared by every session; id(ws) is the fallback for bare objects.
+    return _ledger_snapshot_key(ws) or id(ws)
+
+
+def _ledger_lock(ws) -> threading.RLock:
+    """Per-worksheet lock: one session fetches or writes while the others wait and reuse its result."""
+    key = _worksheet_cache_key(ws)
+    with _LEDGER_LOCKS_GUARD:
+        return _LEDGER_LOCKS.setdefault(key, threading.RLock())
 
 
 def _google_error_status(exc: Exception) -> int | None:
@@ -380,8 +514,13 @@ def _is_temporary_google_error(exc: Exception) -> bool:
     return _google_error_status(exc) in GOOGLE_TEMPORARY_STATUS_CODES
 
 
+def _google_debug() -> dict[str, Any]:
+    # Per session: the ledger caches are shared, but each session reports its own reads.
+    return st.session_state.setdefault("google_sheets_debug", dict(GOOGLE_DEBUG_DEFAULTS))
+
+
 def google_sheets_debug() -> dict[str, Any]:
-    return dict(_GOOGLE_DEBUG)
+    return dict(_google_debug())
 
 
 def invalidate_data_cache(ws=None) -> None:
@@ -389,29 +528,262 @@ def invalidate_data_cache(ws=None) -> None:
         _GOOGLE_READ_CACHE.clear()
     else:
         _GOOGLE_READ_CACHE.pop(_worksheet_cache_key(ws), None)
-    try:
-        load_data_cached.clear()
-    except Exception:
-        pass
 
 
-def _read_records_with_retry(ws, *, max_attempts: int = 3) -> list[dict[str, Any]]:
+def _remember_headers(ws, headers: list[str], unknown: list[str]) -> None:
+    # The entry keeps a reference to ws so its id() cannot be reused by another worksheet.
+    _HEADER_CACHE[_worksheet_cache_key(ws)] = {
+        "ws": ws,
+        "headers": list(headers),
+        "unknown": list(unknown),
+        "fingerprint": _header_fingerprint(headers),
+    }
+
+
+def invalidate_header_cache(ws=None) -> None:
+    if ws is None:
+        _HEADER_CACHE.clear()
+    else:
+        _HEADER_CACHE.pop(_worksheet_cache_key(ws), None)
+
+
+def _check_cached_headers(ws, headers: list[str]) -> None:
+    """Drop the cached schema of ws if the header row just read no longer matches it."""
+    cached = _HEADER_CACHE.get(_worksheet_cache_key(ws))
+    if cached is not None and cached["fingerprint"] != _header_fingerprint(headers):
+        invalidate_header_cache(ws)
+
+
+def worksheet_headers(ws) -> tuple[list[str], list[str]]:
+    """Validated headers of ws, reading row 1 only when the cached schema is missing or stale."""
+    cached = _HEADER_CACHE.get(_worksheet_cache_key(ws))
+    if cached is not None and cached["ws"] is ws:
+        return list(cached["headers"]), list(cached["unknown"])
+    return validate_and_migrate_headers(ws)
+
+
+def _google_read_with_retry(read, *, max_attempts: int = 3):
     last_exc: Exception | None = None
     for attempt in range(1, max_attempts + 1):
-        _GOOGLE_DEBUG["read_attempts"] = attempt
+        _google_debug()["read_attempts"] = attempt
         try:
-            return ws.get_all_records()
+            return read()
         except Exception as exc:
             last_exc = exc
             if not _is_temporary_google_error(exc):
                 raise InventoryError("Δεν ήταν δυνατή η ανάγνωση των κινήσεων από το Google Sheets.") from exc
-            _GOOGLE_DEBUG["last_temporary_error_type"] = f"http_{_google_error_status(exc)}"
+            _google_debug()["last_temporary_error_type"] = f"http_{_google_error_status(exc)}"
             if attempt >= max_attempts:
                 break
             time.sleep(0.25 * (2 ** (attempt - 1)))
     raise InventoryError("Προσωρινό πρόβλημα σύνδεσης με το Google Sheets. Δοκίμασε ξανά σε λίγο.") from last_exc
 
 
+def _read_records_with_retry(ws, *, max_attempts: int = 3) -> list[dict[str, Any]]:
+    return _google_read_with_retry(ws.get_all_records, max_attempts=max_attempts)
+
+
+def _column_letter(index: int) -> str:
+    letters = ""
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def reset_ledger_sync(ws=None) -> None:
+    """Forget the incremental sync position so the next read is a full read."""
+    if ws is None:
+        _LEDGER_SYNC_STATE.clear()
+    else:
+        _LEDGER_SYNC_STATE.pop(_worksheet_cache_key(ws), None)
+
+
+def _trimmed_headers(headers) -> list[str]:
+    headers = list(headers)
+    while headers and not clean(headers[-1]):
+        headers.pop()
+    return headers
+
+
+def _tail_records(headers: list[str], values: list[list[Any]]) -> list[dict[str, Any]]:
+    width = len(headers)
+    rows = [list(row)[:width] + [""] * (width - len(row)) for row in values]
+    return [dict(zip(headers, gspread.utils.numericise_all(row))) for row in rows]
+
+
+def _sync_ledger_tail(ws, state: dict[str, Any]) -> pd.DataFrame | None:
+    """Rows appended since the last sync, or None when the headers or the anchor row changed."""
+    row_count = state["row_count"]
+    if row_count and not clean(state["anchor_id"]):
+        return None
+    width = max(len(state["headers"]), len(COLUMNS))
+    start_row = row_count + 1 if row_count else 2
+    try:
+        header_range, tail_range = _google_read_with_retry(
+            lambda: ws.batch_get(["1:1", f"A{start_row}:{_column_letter(width)}"])
+        )
+    except InventoryError:
+        return None
+    headers = _trimmed_headers(header_range[0]) if header_range else []
+    if headers:
+        _check_cached_headers(ws, [clean(h) for h in headers])
+    if not headers or (row_count and headers != state["headers"]):
+        return None
+    values = [list(row) for row in tail_range]
+    if row_count:
+        anchor = _tail_records(headers, values[:1])
+        if not anchor or clean(anchor[0].get("TransactionId", "")) != clean(state["anchor_id"]):
+            return None
+        values = values[1:]
+    records = _tail_records(headers, values)
+    data = state["data"]
+    if records:
+        tail = records_to_dataframe(records)
+        _extend_transaction_index(state["index"], tail, len(data))
+        data = compact_ledger(pd.concat([data, tail], ignore_index=True))
+        _add_stock_balances(state["balances"], tail)
+        state["anchor_id"] = clean(records[-1].get("TransactionId", ""))
+    state.update({"headers": headers, "row_count": row_count + len(records), "data": data})
+    _google_debug().update({"sync_mode": "incremental", "tail_rows": len(records)})
+    return data
+
+
+def _ledger_snapshot_key(ws) -> str:
+    spreadsheet_id = clean(getattr(getattr(ws, "spreadsheet", None), "id", ""))
+    if not spreadsheet_id:
+        return ""
+    return f"{spreadsheet_id}:{getattr(ws, 'id', '')}"
+
+
+def ledger_identity(ws) -> tuple[str, str]:
+    """(spreadsheet id, worksheet title) of the sheet a ledger frame was read from."""
+    return clean(getattr(getattr(ws, "spreadsheet", None), "id", "")), clean(getattr(ws, "title", ""))
+
+
+def _header_fingerprint(headers: list[str]) -> str:
+    return hashlib.sha256("\x1f".join(headers).encode("utf-8")).hexdigest()[:16]
+
+
+def _snapshot_connection() -> sqlite3.Connection:
+    if not LEDGER_SNAPSHOT_PATH.exists():
+        LEDGER_SNAPSHOT_PATH.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        os.close(os.open(LEDGER_SNAPSHOT_PATH, os.O_CREAT | os.O_WRONLY, 0o600))
+    conn = sqlite3.connect(LEDGER_SNAPSHOT_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS ledger_snapshot ("
+        "sheet_key TEXT PRIMARY KEY, header_hash TEXT NOT NULL, headers TEXT NOT NULL, "
+        "row_count INTEGER NOT NULL, anchor_id TEXT NOT NULL, saved_at TEXT NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS ledger_snapshot_rows ("
+        "sheet_key TEXT NOT NULL, position INTEGER NOT NULL, payload TEXT NOT NULL, "
+        "PRIMARY KEY (sheet_key, position))"
+    )
+    return conn
+
+
+def _save_ledger_snapshot(ws, state: dict[str, Any], rows: pd.DataFrame, *, start: int) -> None:
+    """Persist normalized ledger rows so a cold start only needs the tail read."""
+    sheet_key = _ledger_snapshot_key(ws)
+    if not sheet_key or LEDGER_SNAPSHOT_PATH is None:
+        return
+    payloads = [
+        (sheet_key, start + offset, json.dumps(values, ensure_ascii=False, default=str))
+        for offset, values in enumerate(rows[COLUMNS].astype(object).values.tolist())
+    ]
+    try:
+        with closing(_snapshot_connection()) as conn, conn:
+            if start == 0:
+                conn.execute("DELETE FROM ledger_snapshot_rows WHERE sheet_key = ?", (sheet_key,))
+            conn.executemany("INSERT OR REPLACE INTO ledger_snapshot_rows VALUES (?, ?, ?)", payloads)
+            conn.execute(
+                "INSERT OR REPLACE INTO ledger_snapshot VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    sheet_key,
+                    _header_fingerprint(state["headers"]),
+                    json.dumps(state["headers"], ensure_ascii=False),
+                    state["row_count"],
+                    state["anchor_id"],
+                    datetime.now().isoformat(timespec="seconds"),
+                ),
+            )
+        _google_debug()["snapshot"] = "saved"
+    except (sqlite3.Error, OSError, TypeError, ValueError) as exc:
+        _google_debug()["snapshot"] = f"save_failed: {exc}"
+
+
+def _load_ledger_snapshot(ws) -> dict[str, Any] | None:
+    sheet_key = _ledger_snapshot_key(ws)
+    if not sheet_key or LEDGER_SNAPSHOT_PATH is None or not LEDGER_SNAPSHOT_PATH.exists():
+        return None
+    try:
+        with closing(_snapshot_connection()) as conn:
+            meta = conn.execute(
+                "SELECT header_hash, headers, row_count, anchor_id FROM ledger_snapshot WHERE sheet_key = ?",
+                (sheet_key,),
+            ).fetchone()
+            if meta is None:
+                return None
+            header_hash, headers_json, row_count, anchor_id = meta
+            headers = json.loads(headers_json)
+            if _header_fingerprint(headers) != header_hash:
+                return None
+            payloads = conn.execute(
+                "SELECT payload FROM ledger_snapshot_rows WHERE sheet_key = ? ORDER BY position",
+                (sheet_key,),
+            ).fetchall()
+        if len(payloads) != row_count:
+            return None
+        data = pd.DataFrame([json.loads(payload) for (payload,) in payloads], columns=COLUMNS)
+        data["DeltaQty"] = data["DeltaQty"].astype(int)
+        data = compact_ledger(data)
+    except (sqlite3.Error, OSError, TypeError, ValueError) as exc:
+        _google_debug()["snapshot"] = f"load_failed: {exc}"
+        return None
+    _google_debug()["snapshot"] = "restored"
+    return {
+        "headers": headers,
+        "row_count": row_count,
+        "anchor_id": anchor_id,
+        "data": data,
+        "balances": stock_balances(data),
+        "index": transaction_index(data),
+    }
+
+
+def _sync_ledger(ws) -> pd.DataFrame:
+    key = _worksheet_cache_key(ws)
+    state = _LEDGER_SYNC_STATE.get(key)
+    if hasattr(ws, "batch_get"):
+        if state is None:
+            state = _load_ledger_snapshot(ws)
+        if state is not None:
+            known_rows = state["row_count"]
+            data = _sync_ledger_tail(ws, state)
+            if data is not None:
+                _LEDGER_SYNC_STATE[key] = state
+                if state["row_count"] > known_rows:
+                    _save_ledger_snapshot(ws, state, data.iloc[known_rows:], start=known_rows)
+                return data
+    records = _read_records_with_retry(ws)
+    if records:
+        _check_cached_headers(ws, [clean(h) for h in _trimmed_headers(records[0])])
+    data = records_to_dataframe(records)
+    state = {
+        "headers": _trimmed_headers(records[0]) if records else [],
+        "row_count": len(records),
+        "anchor_id": clean(records[-1].get("TransactionId", "")) if records else "",
+        "data": data,
+        "balances": stock_balances(data),
+        "index": transaction_index(data),
+    }
+    _LEDGER_SYNC_STATE[key] = state
+    _google_debug().update({"sync_mode": "full", "tail_rows": len(records)})
+    _save_ledger_snapshot(ws, state, data, start=0)
+    return data
+
+
 def load_data(ws) -> tuple[pd.DataFrame, list[str]]:
     # Ordinary reads do not mutate/migrate schema. Schema initialization is explicit.
     # Avoid an extra Google API call on ordinary reads; worksheet() or initialize_schema() validates live headers.
@@ -420,43 +792,119 @@ def load_data(ws) -> tuple[pd.DataFrame, list[str]]:
     if duplicates:
         raise SchemaError("Υπάρχουν διπλές επικεφαλίδες στο Google Sheet: " + ", ".join(duplicates))
     unknown = [header for header in headers if header and header not in COLUMNS and header not in DEPRECATED_COLUMNS]
-    records = _read_records_with_retry(ws)
-    df = records_to_dataframe(records)
-    _GOOGLE_DEBUG.update({"cached": False, "row_count": len(df)})
-    return df.copy(deep=True), list(unknown)
+    with _ledger_lock(ws):
+        df = _sync_ledger(ws)
+    _google_debug().update({"cached": False, "row_count": len(df)})
+    output = df.copy(deep=False)
+    output.attrs["ledger"] = ledger_identity(ws)
+    return output, list(unknown)
 
 
-def load_data_cached(ws, *, ttl_seconds: int = GOOGLE_READ_CACHE_TTL_SECONDS) -> tuple[pd.DataFrame, list[str]]:
-    key = _worksheet_cache_key(ws)
+def _fresh_cache_entry(key, ttl_seconds: int) -> dict[str, Any] | None:
     cached = _GOOGLE_READ_CACHE.get(key)
-    now = time.monotonic()
-    if cached and now - cached["timestamp"] <= ttl_seconds:
-        _GOOGLE_DEBUG.update({"cached": True, "read_attempts": 0, "row_count": len(cached["data"])})
-        return cached["data"].copy(deep=True), list(cached["unknown"])
-    data, unknown = load_data(ws)
-    _GOOGLE_READ_CACHE[key] = {"timestamp": now, "data": data.copy(deep=True), "unknown": list(unknown)}
-    return data.copy(deep=True), list(unknown)
+    if cached and time.monotonic() - cached["timestamp"] <= ttl_seconds:
+        _google_debug().update({"cached": True, "read_attempts": 0, "row_count": len(cached["data"])})
+        return cached
+    return None
 
 
-def append_row(ws, row: dict[str, Any]) -> None:
-    headers, _ = validate_and_migrate_headers(ws)
+def load_data_cached(ws, *, ttl_seconds: int = GOOGLE_READ_CACHE_TTL_SECONDS) -> tuple[pd.DataFrame, list[str]]:
+    key = _worksheet_cache_key(ws)
+    cached = _fresh_cache_entry(key, ttl_seconds)
+    if cached is None:
+        with _ledger_lock(ws):
+            cached = _fresh_cache_entry(key, ttl_seconds)
+            if cached is None:
+                now = time.monotonic()
+                data, unknown = load_data(ws)
+                cached = {"timestamp": now, "data": data, "unknown": list(unknown)}
+                _GOOGLE_READ_CACHE[key] = cached
+    return cached["data"].copy(deep=False), list(cached["unknown"])
+
+
+def append_rows(ws, rows: list[dict[str, Any]]) -> None:
+    headers, _ = worksheet_headers(ws)
     writable_headers = [header for header in headers if header not in DEPRECATED_COLUMNS]
     try:
-        ws.append_row(
-            [row.get(header, "") for header in writable_headers],
+        ws.append_rows(
+            [[row.get(header, "") for header in writable_headers] for row in rows],
             value_input_option="RAW",
         )
     except Exception as exc:
+        # A failed write may mean the sheet layout changed; validate row 1 again next time.
+        invalidate_header_cache(ws)
         raise InventoryError("Δεν ήταν δυνατή η αποθήκευση της κίνησης.") from exc
 
 
+def append_row(ws, row: dict[str, Any]) -> None:
+    append_rows(ws, [row])
+
+
 def active_movements(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty:
         return df.copy()
     return df[~df["Voided"].map(bool)].copy()
 
 
-def current_stock(df: pd.DataFrame, code_type: str, code_value: str, location_id: int) -> int:
+def stock_balances(df: pd.DataFrame) -> dict[tuple[str, str, int], int]:
+    """Running stock per (CodeType, CodeValue, LocationId) for the active movements."""
+    active = active_movements(df)
+    if active.empty:
+        return {}
+    grouped = active.groupby(["CodeType", "CodeValue", "LocationId"], dropna=False, sort=False, observed=True)["DeltaQty"].sum()
+    return {(str(code_type), str(code_value), int(location_id)): int(qty) for (code_type, code_value, location_id), qty in grouped.items()}
+
+
+def _add_stock_balances(balances: dict[tuple[str, str, int], int], df: pd.DataFrame) -> None:
+    for key, qty in stock_balances(df).items():
+        balances[key] = balances.get(key, 0) + qty
+
+
+def _synced_ledger_state(ws, df: pd.DataFrame) -> dict[str, Any] | None:
+    state = _LEDGER_SYNC_STATE.get(_worksheet_cache_key(ws))
+    if state is not None and state["row_count"] == len(df):
+        return state
+    return None
+
+
+def ledger_stock_balances(ws, df: pd.DataFrame) -> dict[tuple[str, str, int], int]:
+    """Balances maintained by the ledger sync for ws, rebuilt if df is not the synced frame."""
+    state = _synced_ledger_state(ws, df)
+    return state["balances"] if state is not None else stock_balances(df)
+
+
+def transaction_index(df: pd.DataFrame) -> dict[str, Any]:
+    """TransactionId -> first row position and VoidOf -> ids of the rows that reverse it."""
+    index: dict[str, Any] = {"positions": {}, "reversed_by": {}}
+    _extend_transaction_index(index, df, 0)
+    return index
+
+
+def _extend_transaction_index(index: dict[str, Any], df: pd.DataFrame, offset: int) -> None:
+    positions = index["positions"]
+    reversed_by = index["reversed_by"]
+    transaction_ids = df["TransactionId"].astype(str).tolist()
+    for position, transaction_id in enumerate(transaction_ids, start=offset):
+        positions.setdefault(transaction_id, position)
+    for transaction_id, void_of in zip(transaction_ids, df["VoidOf"].astype(str).tolist()):
+        if void_of.strip():
+            reversed_by.setdefault(void_of, set()).add(transaction_id)
+
+
+def ledger_transaction_index(ws, df: pd.DataFrame) -> dict[str, Any]:
+    state = _synced_ledger_state(ws, df)
+    return state["index"] if state is not None else transaction_index(df)
+
+
+def current_stock(
+    df: pd.DataFrame,
+    code_type: str,
+    code_value: str,
+    location_id: int,
+    balances: dict[tuple[str, str, int], int] | None = None,
+) -> int:
+    if balances is not None:
+        return int(balances.get((str(code_type), str(code_value), int(location_id)), 0))
     active = active_movements(df)
     if active.empty:
         return 0
@@ -468,24 +916,33 @@ def current_stock(df: pd.DataFrame, code_type: str, code_value: str, location_id
     return int(active.loc[mask, "DeltaQty"].sum())
 
 
-def transaction_exists(df: pd.DataFrame, transaction_id: str) -> bool:
+def transaction_exists(df: pd.DataFrame, transaction_id: str, index: dict[str, Any] | None = None) -> bool:
+    if index is not None:
+        return clean(transaction_id) in index["positions"]
     return df["TransactionId"].astype(str).eq(clean(transaction_id)).any()
 
 
-def reversal_exists(df: pd.DataFrame, original_id: str) -> bool:
+def reversal_exists(df: pd.DataFrame, original_id: str, index: dict[str, Any] | None = None) -> bool:
     original_id = clean(original_id)
+    if index is not None:
+        return bool(index["reversed_by"].get(original_id)) or transaction_exists(
+            df, deterministic_reversal_id(original_id), index
+        )
     return (
         df["VoidOf"].astype(str).eq(original_id).any()
         or transaction_exists(df, deterministic_reversal_id(original_id))
     )
 
 
-def reversible_rows(df: pd.DataFrame) -> pd.DataFrame:
+def reversible_rows(df: pd.DataFrame, index: dict[str, Any] | None = None) -> pd.DataFrame:
     if df.empty:
         return df.copy()
-    reversed_ids = set(
-        df.loc[df["VoidOf"].astype(str).str.strip().ne(""), "VoidOf"].astype(str)
-    )
+    if index is not None:
+        reversed_ids = set(index["reversed_by"])
+    else:
+        reversed_ids = set(
+            df.loc[df["VoidOf"].astype(str).str.strip().ne(""), "VoidOf"].astype(str)
+        )
     mask = (
         df["TransactionId"].astype(str).str.strip().ne("")
         & ~df["TransactionId"].astype(str).isin(reversed_ids)
@@ -558,65 +1015,102 @@ def make_transaction(
     }
 
 
-def append_stock_transaction(ws, row: dict[str, Any]) -> str:
-    fresh, _ = load_data(ws)
+def _compensation_row(row: dict[str, Any]) -> dict[str, Any]:
     txid = clean(row["TransactionId"])
-    if transaction_exists(fresh, txid):
-        return "duplicate"
-
     delta = int(row["DeltaQty"])
-    if delta < 0:
-        available = current_stock(
-            fresh, row["CodeType"], row["CodeValue"], int(row["LocationId"])
-        )
-        if available + delta < 0:
+    return make_transaction(
+        code_type=row["CodeType"],
+        code_value=row["CodeValue"],
+        barcode=row["Barcode"],
+        pc_code=row.get("PCCode", ""),
+        gtin=row.get("GTIN", ""),
+        serial_number=row.get("SerialNumber", ""),
+        lot_number=row.get("LotNumber", ""),
+        expiry_date=row.get("ExpiryDate", ""),
+        qr_raw_data=row.get("QRRawData", ""),
+        datamatrix_raw_data=row.get("DataMatrixRawData", ""),
+        strength=row.get("Strength", ""),
+        dosage_form=row.get("DosageForm", ""),
+        brand=row["Μάρκα"],
+        product=row["Προϊόν"],
+        category=row["Κατηγορία"],
+        location_id=int(row["LocationId"]),
+        movement="Αυτόματη αντιστάθμιση (+)",
+        quantity=abs(delta),
+        delta=abs(delta),
+        note=f"Αυτόματη αντιστάθμιση για {txid}",
+        transaction_id=deterministic_compensation_id(txid),
+        void_of=txid,
+        movement_kind=COMPENSATION,
+    )
+
+
+def _stock_key(row: dict[str, Any]) -> tuple[str, str, int]:
+    return str(row["CodeType"]), str(row["CodeValue"]), int(row["LocationId"])
+
+
+def append_stock_transactions(ws, rows: list[dict[str, Any]]) -> list[str]:
+    """Append a batch all-or-nothing; returns "saved", "duplicate" or "compensated" per row."""
+    if not rows:
+        return []
+    with _ledger_lock(ws):
+        return _append_stock_transactions_locked(ws, rows)
+
+
+def _append_stock_transactions_locked(ws, rows: list[dict[str, Any]]) -> list[str]:
+    fresh, _ = load_data(ws)
+    index = ledger_transaction_index(ws, fresh)
+    balances = dict(ledger_stock_balances(ws, fresh))
+    statuses: list[str] = []
+    pending: list[tuple[int, dict[str, Any]]] = []
+    batch_ids: set[str] = set()
+    for position, row in enumerate(rows):
+        txid = clean(row["TransactionId"])
+        if txid in batch_ids or transaction_exists(fresh, txid, index):
+            statuses.append("duplicate")
+            continue
+        batch_ids.add(txid)
+        key = _stock_key(row)
+        delta = int(row["DeltaQty"])
+        available = balances.get(key, 0)
+        if delta < 0 and available + delta < 0:
             raise InventoryError(
                 f"Η κίνηση θα έκανε το stock αρνητικό. "
                 f"Διαθέσιμα: {available}, ζητήθηκαν: {abs(delta)}."
             )
+        balances[key] = available + delta
+        statuses.append("saved")
+        pending.append((position, row))
+    if not pending:
+        return statuses
 
-    append_row(ws, row)
+    append_rows(ws, [row for _, row in pending])
     invalidate_data_cache(ws)
-    if delta >= 0:
-        return "saved"
+    negative = [(position, row) for position, row in pending if int(row["DeltaQty"]) < 0]
+    if not negative:
+        return statuses
 
     verified, _ = load_data(ws)
-    after = current_stock(
-        verified, row["CodeType"], row["CodeValue"], int(row["LocationId"])
-    )
-    if after >= 0:
-        return "saved"
-
-    compensation_id = deterministic_compensation_id(txid)
-    if not transaction_exists(verified, compensation_id):
-        compensation = make_transaction(
-            code_type=row["CodeType"],
-            code_value=row["CodeValue"],
-            barcode=row["Barcode"],
-            pc_code=row.get("PCCode", ""),
-            gtin=row.get("GTIN", ""),
-            serial_number=row.get("SerialNumber", ""),
-            lot_number=row.get("LotNumber", ""),
-            expiry_date=row.get("ExpiryDate", ""),
-            qr_raw_data=row.get("QRRawData", ""),
-            datamatrix_raw_data=row.get("DataMatrixRawData", ""),
-            strength=row.get("Strength", ""),
-            dosage_form=row.get("DosageForm", ""),
-            brand=row["Μάρκα"],
-            product=row["Προϊόν"],
-            category=row["Κατηγορία"],
-            location_id=int(row["LocationId"]),
-            movement="Αυτόματη αντιστάθμιση (+)",
-            quantity=abs(delta),
-            delta=abs(delta),
-            note=f"Αυτόματη αντιστάθμιση για {txid}",
-            transaction_id=compensation_id,
-            void_of=txid,
-            movement_kind=COMPENSATION,
-        )
-        append_row(ws, compensation)
+    verified_index = ledger_transaction_index(ws, verified)
+    verified_balances = dict(ledger_stock_balances(ws, verified))
+    compensations: list[dict[str, Any]] = []
+    for position, row in negative:
+        key = _stock_key(row)
+        if verified_balances.get(key, 0) >= 0:
+            continue
+        statuses[position] = "compensated"
+        compensation = _compensation_row(row)
+        if not transaction_exists(verified, compensation["TransactionId"], verified_index):
+            compensations.append(compensation)
+            verified_balances[key] = verified_balances.get(key, 0) + int(compensation["DeltaQty"])
+    if compensations:
+        append_rows(ws, compensations)
         invalidate_data_cache(ws)
-    return "compensated"
+    return statuses
+
+
+def append_stock_transaction(ws, row: dict[str, Any]) -> str:
+    return append_stock_transactions(ws, [row])[0]
 
 
 def append_reversal(ws, original: pd.Series, reason: str = "") -> str:
@@ -625,7 +1119,7 @@ def append_reversal(ws, original: pd.Series, reason: str = "") -> str:
         raise InventoryError("Η παλιά κίνηση δεν έχει TransactionId και δεν αναστρέφεται.")
 
     fresh, _ = load_data(ws)
-    if reversal_exists(fresh, original_id):
+    if reversal_exists(fresh, original_id, ledger_transaction_index(ws, fresh)):
         return "duplicate"
 
     kind = clean(original.get("MovementKind", NORMAL))
@@ -678,12 +1172,12 @@ def stock_table(df: pd.DataFrame) -> pd.DataFrame:
     data["Timestamp_dt"] = pd.to_datetime(data["Timestamp"], errors="coerce")
     latest = (
         data.sort_values("Timestamp_dt")
-        .groupby(identity, dropna=False)
+        .groupby(identity, dropna=False, observed=True)
         .tail(1)[identity + ["Barcode", "PCCode", "GTIN", "SerialNumber", "LotNumber", "ExpiryDate", "QRRawData", "DataMatrixRawData", "Μάρκα", "Προϊόν", "Κατηγορία", "Strength", "DosageForm"]]
     )
-    grouped = data.groupby(identity + ["LocationId"], dropna=False)["DeltaQty"].sum().reset_index()
+    grouped = data.groupby(identity + ["LocationId"], dropna=False, observed=True)["DeltaQty"].sum().reset_index()
     pivot = grouped.pivot_table(
-        index=identity, columns="LocationId", values="DeltaQty", fill_value=0
+        index=identity, columns="LocationId", values="DeltaQty", fill_value=0, observed=True
     ).reset_index()
     pivot = pivot.rename(columns={0: "Αποθήκη", 1: "Κύριο Κτήριο", 2: "Πρώτος Όροφος"})
     for column in ["Αποθήκη", "Κύριο Κτήριο", "Πρώτος Όροφος"]:
@@ -731,6 +1225,31 @@ def expiry_warning(expiry: Any, today: date | None = None) -> str:
     return f"🟢 Ισχύει έως {expiry_dt:%Y-%m-%d}"
 
 
+def ledger_version(df: pd.DataFrame) -> tuple[int, str]:
+    """Row count and last TransactionId; the ledger is append-only, so this changes with every movement."""
+    if df.empty:
+        return 0, ""
+    return len(df), clean(df["TransactionId"].iat[-1])
+
+
+def cached_ledger_view(df: pd.DataFrame, builder) -> pd.DataFrame:
+    """builder(df) memoized per sheet, ledger version and day, so reruns and tabs share one result."""
+    key = (f"{builder.__module__}.{builder.__qualname__}", df.attrs.get("ledger", ("", "")), ledger_version(df), date.today())
+    with _LEDGER_VIEW_LOCK:
+        cached = _LEDGER_VIEW_CACHE.get(key)
+    if cached is None:
+        cached = builder(df)
+        with _LEDGER_VIEW_LOCK:
+            _LEDGER_VIEW_CACHE[key] = cached
+            while len(_LEDGER_VIEW_CACHE) > LEDGER_VIEW_CACHE_SIZE:
+                _LEDGER_VIEW_CACHE.pop(next(iter(_LEDGER_VIEW_CACHE)))
+    return cached.copy(deep=False)
+
+
+def cached_stock_table(df: pd.DataFrame) -> pd.DataFrame:
+    return cached_ledger_view(df, stock_table)
+
+
 def add_expiry_columns(stock: pd.DataFrame, today: date | None = None) -> pd.DataFrame:
     output = stock.copy()
     if "ExpiryDate" not in output.columns:
@@ -791,6 +1310,152 @@ def file_hash(file) -> str:
     return hashlib.sha256(file.getvalue()).hexdigest()
 
 
+ANALYSIS_CACHE_SIZE = 64
+# Set to a path to keep analysis results across restarts; None keeps them in memory only.
+ANALYSIS_CACHE_PATH: Path | None = None
+_ANALYSIS_CACHE: OrderedDict[tuple[str, str], Any] = shared("analysis_cache", OrderedDict)
+_ANALYSIS_CACHE_LOCK: threading.Lock = shared("analysis_cache_lock", threading.Lock)
+_ANALYSIS_CACHE_STATS: dict[str, int] = shared("analysis_cache_stats", lambda: {"hits": 0, "misses": 0, "disk_hits": 0})
+
+
+def analysis_cache_stats() -> dict[str, int]:
+    with _ANALYSIS_CACHE_LOCK:
+        return {**_ANALYSIS_CACHE_STATS, "entries": len(_ANALYSIS_CACHE)}
+
+
+def clear_analysis_cache() -> None:
+    with _ANALYSIS_CACHE_LOCK:
+        _ANALYSIS_CACHE.clear()
+        _ANALYSIS_CACHE_STATS.update({"hits": 0, "misses": 0, "disk_hits": 0})
+
+
+def _analysis_disk_connection() -> sqlite3.Connection:
+    conn = sqlite3.connect(ANALYSIS_CACHE_PATH, timeout=5)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS analysis_cache ("
+        "kind TEXT NOT NULL, image_hash TEXT NOT NULL, payload TEXT NOT NULL, created_at TEXT NOT NULL, "
+        "PRIMARY KEY (kind, image_hash))"
+    )
+    return conn
+
+
+def _analysis_disk_get(key: tuple[str, str]) -> Any:
+    if ANALYSIS_CACHE_PATH is None:
+        return None
+    try:
+        with closing(_analysis_disk_connection()) as conn:
+            row = conn.execute("SELECT payload FROM analysis_cache WHERE kind = ? AND image_hash = ?", key).fetchone()
+        return json.loads(row[0]) if row else None
+    except (sqlite3.Error, OSError, ValueError):
+        return None
+
+
+def _analysis_disk_put(key: tuple[str, str], value: Any) -> None:
+    if ANALYSIS_CACHE_PATH is None:
+        return
+    try:
+        payload = json.dumps(value, ensure_ascii=False, default=str)
+        with closing(_analysis_disk_connection()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache VALUES (?, ?, ?, ?)",
+                (*key, payload, datetime.now().isoformat(timespec="seconds")),
+            )
+    except (sqlite3.Error, OSError, TypeError, ValueError):
+        pass
+
+
+def _analysis_debugs(value: Any) -> Iterator[dict[str, Any]]:
+    # Analyses return (..., debug) tuples or dicts holding "*_debug" entries.
+    if isinstance(value, (tuple, list)) and value and isinstance(value[-1], dict):
+        yield value[-1]
+    elif isinstance(value, dict):
+        yield from (item for key, item in value.items() if key.endswith("debug") and isinstance(item, dict))
+
+
+def analysis_incomplete(value: Any) -> bool:
+    """True when a debug in the result shows an OCR timeout or unavailable OCR; such results are not cached."""
+    for debug in _analysis_debugs(value):
+        if debug.get("timed_out"):
+            return True
+        if not debug.get("skipped") and "no" in (debug.get("available"), debug.get("ocr", {}).get("available")):
+            return True
+    return False
+
+
+def cached_analysis(kind: str, image_hash: str, compute) -> Any:
+    """compute() memoized per (kind, image hash) for all sessions; incomplete results are not stored."""
+    if not image_hash:
+        return compute()
+    key = (kind, image_hash)
+    with _ANALYSIS_CACHE_LOCK:
+        if key in _ANALYSIS_CACHE:
+            _ANALYSIS_CACHE.move_to_end(key)
+            _ANALYSIS_CACHE_STATS["hits"] += 1
+            return copy.deepcopy(_ANALYSIS_CACHE[key])
+    value = _analysis_disk_get(key)
+    with _ANALYSIS_CACHE_LOCK:
+        _ANALYSIS_CACHE_STATS["disk_hits" if value is not None else "misses"] += 1
+    if value is None:
+        value = compute()
+        if analysis_incomplete(value):
+            return value
+        _analysis_disk_put(key, value)
+    with _ANALYSIS_CACHE_LOCK:
+        _ANALYSIS_CACHE[key] = copy.deepcopy(value)
+        _ANALYSIS_CACHE.move_to_end(key)
+        while len(_ANALYSIS_CACHE) > ANALYSIS_CACHE_SIZE:
+            _ANALYSIS_CACHE.popitem(last=False)
+    return value
+
+
+
+OCR_CACHE_SIZE = 512
+_OCR_CACHE: OrderedDict[tuple[str, str, int, str, str], str] = shared("ocr_cache", OrderedDict)
+_OCR_CACHE_LOCK: threading.Lock = shared("ocr_cache_lock", threading.Lock)
+_OCR_CACHE_STATS: dict[str, int] = shared("ocr_cache_stats", lambda: {"hits": 0, "misses": 0, "disk_hits": 0})
+
+
+def ocr_cache_stats() -> dict[str, int]:
+    with _OCR_CACHE_LOCK:
+        return {**_OCR_CACHE_STATS, "entries": len(_OCR_CACHE)}
+
+
+def clear_ocr_cache() -> None:
+    with _OCR_CACHE_LOCK:
+        _OCR_CACHE.clear()
+        _OCR_CACHE_STATS.update({"hits": 0, "misses": 0, "disk_hits": 0})
+
+
+def cached_ocr(image_hash: str, variant: str, psm: int, lang: str, compute, *, whitelist: str = "", stats: dict[str, int] | None = None) -> str:
+    """Tesseract text memoized per (image hash, variant, psm, lang, whitelist)."""
+    if not image_hash:
+        return compute()
+    key = (image_hash, variant, psm, lang, whitelist)
+    disk_key = (f"ocr:{variant}:psm{psm}:{lang}:{whitelist}", image_hash)
+
+    def count(outcome: str) -> None:
+        _OCR_CACHE_STATS[outcome] += 1
+        if stats is not None:
+            stats[outcome] = stats.get(outcome, 0) + 1
+
+    with _OCR_CACHE_LOCK:
+        if key in _OCR_CACHE:
+            _OCR_CACHE.move_to_end(key)
+            count("hits")
+            return _OCR_CACHE[key]
+    text = _analysis_disk_get(disk_key)
+    with _OCR_CACHE_LOCK:
+        count("disk_hits" if text is not None else "misses")
+    if text is None:
+        text = compute()
+        _analysis_disk_put(disk_key, text)
+    with _OCR_CACHE_LOCK:
+        _OCR_CACHE[key] = text
+        _OCR_CACHE.move_to_end(key)
+        while len(_OCR_CACHE) > OCR_CACHE_SIZE:
+            _OCR_CACHE.popitem(last=False)
+    return text
+
 
 LOOKUP_STATE_KEYS = {
     "lookup_query",
@@ -999,6 +1664,7 @@ def _empty_ocr_debug() -> dict[str, Any]:
         "selected_candidate": "",
         "variant_results": [],
         "timed_out": False,
+        "ocr_cache": {"hits": 0, "misses": 0, "disk_hits": 0},
     }
 
 def decoder_status() -> dict[str, str]:
@@ -1006,41 +1672,146 @@ def decoder_status() -> dict[str, str]:
         "pyzbar": "available" if pyzbar_decode else f"failed: {PYZBAR_IMPORT_ERROR}",
         "opencv_barcode": "available" if hasattr(cv2, "barcode") else "failed: cv2.barcode is not available",
         "opencv_qr": "available" if hasattr(cv2, "QRCodeDetector") else "failed: cv2.QRCodeDetector is not available",
+        "datamatrix": _datamatrix_status(),
     }
 
 
-def barcode_variants(image: np.ndarray) -> list[tuple[str, np.ndarray]]:
-    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+def _datamatrix_status() -> str:
+    if zxingcpp is not None:
+        return "available: zxing-cpp"
+    if pylibdmtx_decode is not None:
+        return "available: pylibdmtx"
+    return f"failed: zxing-cpp {ZXINGCPP_IMPORT_ERROR}; pylibdmtx {PYLIBDMTX_IMPORT_ERROR}"
+
+
+def datamatrix_available() -> bool:
+    return zxingcpp is not None or pylibdmtx_decode is not None
+
+
+def datamatrix_fast() -> bool:
+    """zxing-cpp answers in milliseconds; pylibdmtx may spend its whole timeout on a photo without a DataMatrix."""
+    return zxingcpp is not None
+
+
+def decode_datamatrix(image: np.ndarray) -> list[str]:
+    """Raw DataMatrix payloads; zbar cannot decode DataMatrix, so this needs zxing-cpp or pylibdmtx."""
+    if zxingcpp is not None:
+        results = zxingcpp.read_barcodes(image, formats=zxingcpp.BarcodeFormat.DataMatrix)
+        # bytes keeps the GS1 group separators that text renders as "<GS>".
+        values = [result.bytes.decode("utf-8", errors="replace") for result in results]
+    elif pylibdmtx_decode is not None:
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+        decoded = pylibdmtx_decode(Image.fromarray(gray), timeout=DATAMATRIX_TIMEOUT_MS, max_count=2)
+        values = [item.data.decode("utf-8", errors="replace") for item in decoded]
+    else:
+        raise RuntimeError(f"DataMatrix decoder unavailable: {_datamatrix_status()}")
+    return [clean(value) for value in values if clean(value)]
+
+
+def image_context(image: np.ndarray) -> dict[str, Any]:
+    """Per-photo store of derived buffers (gray, resized, CLAHE, Otsu, upscales) shared by the barcode and OCR stages."""
+    return {"image": image, "buffers": {}, "stats": {"computed": 0, "reused": 0}}
+
+
+def derived_buffer(context: dict[str, Any] | None, key: tuple, build) -> Any:
+    """build() computed at most once per context and key; without a context it is simply called."""
+    if context is None:
+        return build()
+    buffers = context["buffers"]
+    if key in buffers:
+        context["stats"]["reused"] += 1
+        return buffers[key]
+    value = buffers[key] = build()
+    context["stats"]["computed"] += 1
+    return value
+
+
+def _grayscale(image: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+
+
+BARCODE_VARIANT_TIERS = (
+    ("original_rgb", "grayscale"),
+    ("increased_contrast", "adaptive_threshold", "sharpened_grayscale"),
+    ("upscale_2x", "upscale_3x"),
+)
+BARCODE_VARIANTS = tuple(name for tier in BARCODE_VARIANT_TIERS for name in tier)
+
+
+def _barcode_variant(name: str, rgb: np.ndarray, gray: np.ndarray) -> np.ndarray:
+    if name == "original_rgb":
+        return rgb
+    if name == "grayscale":
+        return gray
+    if name.startswith("upscale_"):
+        scale = int(name[len("upscale_"):-1])
+        return cv2.resize(rgb, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    if name == "increased_contrast":
+        return np.array(ImageEnhance.Contrast(Image.fromarray(rgb)).enhance(1.8))
+    if name == "adaptive_threshold":
+        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 35, 11)
+    if name == "sharpened_grayscale":
+        return np.array(Image.fromarray(gray).filter(ImageFilter.SHARPEN).filter(ImageFilter.SHARPEN))
+    raise ValueError(f"Unknown barcode variant: {name}")
+
+
+def barcode_variants(image: np.ndarray, names: tuple[str, ...] = BARCODE_VARIANTS, gray: np.ndarray | None = None) -> Iterator[tuple[str, np.ndarray]]:
+    """Lazily yield the requested variants; each one is only computed when the previous ones failed."""
+    gray = _grayscale(image) if gray is None else gray
     rgb = cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB) if image.ndim == 2 else image
-    pil_gray = Image.fromarray(gray)
-    variants = [("original_rgb", rgb), ("grayscale", gray)]
-    for scale in (2, 3):
-        variants.append((f"upscale_{scale}x", cv2.resize(rgb, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)))
-    contrast = ImageEnhance.Contrast(Image.fromarray(rgb)).enhance(1.8)
-    variants.append(("increased_contrast", np.array(contrast)))
-    adaptive = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 35, 11)
-    variants.append(("adaptive_threshold", adaptive))
-    sharpened = pil_gray.filter(ImageFilter.SHARPEN).filter(ImageFilter.SHARPEN)
-    variants.append(("sharpened_grayscale", np.array(sharpened)))
-    return variants
-
-
-def barcode_crops(image: np.ndarray) -> list[tuple[str, np.ndarray]]:
+    for name in names:
+        if name.startswith("upscale_") and max(image.shape[:2]) > BARCODE_MAX_UPSCALE_SIDE:
+            continue
+        yield name, _barcode_variant(name, rgb, gray)
+
+
+def barcode_regions(image: np.ndarray, *, max_side: int = BARCODE_REGION_MAX_SIDE, limit: int = 3) -> list[tuple[int, int, int, int]]:
+    """Full-resolution (x0, y0, x1, y1) boxes of likely 1D barcodes, largest first."""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+    h, w = gray.shape[:2]
+    scale = min(1.0, max_side / max(h, w))
+    small = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+    grad_x = cv2.Sobel(small, cv2.CV_32F, 1, 0, ksize=-1)
+    grad_y = cv2.Sobel(small, cv2.CV_32F, 0, 1, ksize=-1)
+    gradient = cv2.convertScaleAbs(cv2.subtract(cv2.convertScaleAbs(grad_x), cv2.convertScaleAbs(grad_y)))
+    blurred = cv2.blur(gradient, (9, 9))
+    _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (21, 7)))
+    mask = cv2.dilate(cv2.erode(mask, None, iterations=4), None, iterations=4)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = 0.1 * (BARCODE_MIN_CODE_FRACTION * max(small.shape[:2])) ** 2
+    boxes = []
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:limit]:
+        if cv2.contourArea(contour) < min_area:
+            break
+        x, y, bw, bh = cv2.boundingRect(contour)
+        pad_x, pad_y = int(bw * 0.15) + 4, int(bh * 0.15) + 4
+        boxes.append((
+            max(0, int((x - pad_x) / scale)),
+            max(0, int((y - pad_y) / scale)),
+            min(w, int((x + bw + pad_x) / scale)),
+            min(h, int((y + bh + pad_y) / scale)),
+        ))
+    return boxes
+
+
+def barcode_crops(image: np.ndarray, regions: list[tuple[int, int, int, int]] | None = None) -> Iterator[tuple[str, np.ndarray]]:
+    for index, (x0, y0, x1, y1) in enumerate(barcode_regions(image) if regions is None else regions, start=1):
+        yield f"region_{index}", image[y0:y1, x0:x1]
     h, w = image.shape[:2]
     x0, x1 = int(w * 0.25), int(w * 0.75)
     y0, y1 = int(h * 0.25), int(h * 0.75)
-    return [
-        ("complete", image),
-        ("upper_half", image[: h // 2, :]),
-        ("lower_half", image[h // 2 :, :]),
-        ("left_half", image[:, : w // 2]),
-        ("right_half", image[:, w // 2 :]),
-        ("central_region", image[y0:y1, x0:x1]),
-    ]
+    yield "complete", image
+    yield "upper_half", image[: h // 2, :]
+    yield "lower_half", image[h // 2 :, :]
+    yield "left_half", image[:, : w // 2]
+    yield "right_half", image[:, w // 2 :]
+    yield "central_region", image[y0:y1, x0:x1]
 
 
-def barcode_rotations(image: np.ndarray) -> list[tuple[int, np.ndarray]]:
-    return [(0, image), (90, np.rot90(image, 3)), (180, np.rot90(image, 2)), (270, np.rot90(image, 1))]
+def barcode_rotations(image: np.ndarray) -> Iterator[tuple[int, np.ndarray]]:
+    for rotation, turns in ((0, 0), (90, 3), (180, 2), (270, 1)):
+        yield rotation, np.rot90(image, turns) if turns else image
 
 
 def classify_pyzbar_type(kind: str) -> str:
@@ -1106,144 +1877,434 @@ def decode_with_pyzbar(image: np.ndarray) -> list[tuple[str, str, str]]:
     return values
 
 
-def decode_ean13_bars_fallback(image: np.ndarray) -> str:
-    """Small deterministic EAN-13 bar fallback for clean OCR/decoder misses."""
-    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
-    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    black = binary < 128
-    rows = np.where(black.mean(axis=1) > 0.05)[0]
-    cols = np.where(black[rows, :].mean(axis=0) > 0.2)[0] if rows.size else np.array([])
-    if cols.size < 50:
+_EAN_L_CODES = ["0001101", "0011001", "0010011", "0111101", "0100011", "0110001", "0101111", "0111011", "0110111", "0001011"]
+_EAN_G_CODES = ["0100111", "0110011", "0011011", "0100001", "0011101", "0111001", "0000101", "0010001", "0001001", "0010111"]
+_EAN_R_CODES = ["1110010", "1100110", "1101100", "1000010", "1011100", "1001110", "1010000", "1000100", "1001000", "1110100"]
+_EAN_PARITY_TO_FIRST = {"LLLLLL": "0", "LLGLGG": "1", "LLGGLG": "2", "LLGGGL": "3", "LGLLGG": "4", "LGGLLG": "5", "LGGGLL": "6", "LGLGLG": "7", "LGLGGL": "8", "LGGLGL": "9"}
+
+
+def _bit_runs(bits: str) -> list[int]:
+    return [len(run) for run in re.findall(r"0+|1+", bits)]
+
+
+# Each digit as the widths (in modules) of its four bars/spaces: L and G codes for the left half, R for the right.
+_EAN_LEFT_RUNS = np.array([_bit_runs(code) for code in _EAN_L_CODES + _EAN_G_CODES], dtype=float)
+_EAN_RIGHT_RUNS = np.array([_bit_runs(code) for code in _EAN_R_CODES], dtype=float)
+EAN13_FALLBACK_SCANLINES = 15
+EAN13_FALLBACK_BANDS = 4
+EAN13_DIGIT_TOLERANCE = 1.0
+EAN13_GUARD_TOLERANCE = 0.5
+EAN13_QUIET_ZONE_MODULES = 5
+EAN13_FALLBACK_MIN_VOTES = 2
+
+
+def _match_ean_digits(widths: np.ndarray, patterns: np.ndarray) -> np.ndarray | None:
+    normalized = widths * 7.0 / widths.sum(axis=1, keepdims=True)
+    distances = np.abs(normalized[:, None, :] - patterns[None, :, :]).sum(axis=2)
+    best = distances.argmin(axis=1)
+    if distances[np.arange(len(best)), best].max() > EAN13_DIGIT_TOLERANCE:
+        return None
+    return best
+
+
+def _decode_ean13_widths(widths: np.ndarray) -> str:
+    """Decode 61 run widths: quiet zone, the 59 runs from the left guard to the right guard, quiet zone."""
+    module = widths[1:60].sum() / 95.0
+    if min(widths[0], widths[60]) < EAN13_QUIET_ZONE_MODULES * module:
         return ""
-    x0, x1 = int(cols.min()), int(cols.max()) + 1
-    col_black = black[rows.min(): rows.max() + 1, x0:x1].mean(axis=0) > 0.5
-    runs: list[tuple[bool, int]] = []
-    for value in col_black:
-        if not runs or runs[-1][0] != bool(value):
-            runs.append((bool(value), 1))
-        else:
-            runs[-1] = (runs[-1][0], runs[-1][1] + 1)
-    if len(runs) < 20:
+    guards = np.concatenate([widths[1:4], widths[28:33], widths[57:60]]) / module
+    if np.abs(guards - 1.0).max() > EAN13_GUARD_TOLERANCE:
         return ""
-    module = max(1.0, float(np.median([length for _, length in runs[:10] + runs[-10:]])))
-    bits = "".join(("1" if is_black else "0") * max(1, int(round(length / module))) for is_black, length in runs)
-    start = bits.find("101")
-    end = bits.rfind("101")
-    if start < 0 or end <= start:
+    left = _match_ean_digits(widths[4:28].reshape(6, 4), _EAN_LEFT_RUNS)
+    right = _match_ean_digits(widths[33:57].reshape(6, 4), _EAN_RIGHT_RUNS)
+    if left is None or right is None:
         return ""
-    bits = bits[start:end + 3]
-    if len(bits) < 95:
+    parity = "".join("L" if index < 10 else "G" for index in left)
+    first = _EAN_PARITY_TO_FIRST.get(parity)
+    if first is None:
         return ""
-    bits = bits[:95]
-    l = {"0001101":"0","0011001":"1","0010011":"2","0111101":"3","0100011":"4","0110001":"5","0101111":"6","0111011":"7","0110111":"8","0001011":"9"}
-    g = {"0100111":"0","0110011":"1","0011011":"2","0100001":"3","0011101":"4","0111001":"5","0000101":"6","0010001":"7","0001001":"8","0010111":"9"}
-    r = {"1110010":"0","1100110":"1","1101100":"2","1000010":"3","1011100":"4","1001110":"5","1010000":"6","1000100":"7","1001000":"8","1110100":"9"}
-    parity_to_first = {"LLLLLL":"0","LLGLGG":"1","LLGGLG":"2","LLGGGL":"3","LGLLGG":"4","LGGLLG":"5","LGGGLL":"6","LGLGLG":"7","LGLGGL":"8","LGGLGL":"9"}
-    left = bits[3:45]
-    right = bits[50:92]
-    digits = ""
-    parity = ""
-    for i in range(0, 42, 7):
-        chunk = left[i:i+7]
-        if chunk in l:
-            digits += l[chunk]; parity += "L"
-        elif chunk in g:
-            digits += g[chunk]; parity += "G"
-        else:
-            return ""
-    if parity not in parity_to_first:
+    value = first + "".join(str(index % 10) for index in left) + "".join(str(index) for index in right)
+    return value if is_valid_gtin_check_digit(value) else ""
+
+
+def _scanline_ean13(black: np.ndarray) -> str:
+    for line in (black, black[::-1]):
+        changes = np.flatnonzero(line[1:] != line[:-1]) + 1
+        starts = np.concatenate(([0], changes))
+        widths = np.diff(np.concatenate((starts, [line.size]))).astype(float)
+        quiet = widths[:-1] >= EAN13_QUIET_ZONE_MODULES * widths[1:]
+        for index in np.flatnonzero(~line[starts[:-1]] & quiet):
+            if index + 61 > len(widths):
+                break
+            value = _decode_ean13_widths(widths[index:index + 61])
+            if value:
+                return value
+    return ""
+
+
+def decode_ean13_bars_fallback(image: np.ndarray, scanlines: int = EAN13_FALLBACK_SCANLINES) -> str:
+    """Last-resort EAN-13 reader: the code at least EAN13_FALLBACK_MIN_VOTES scanlines agree on, or ""."""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    black = binary < 128
+    rows = np.flatnonzero(black.mean(axis=1) > 0.05)
+    if rows.size == 0:
         return ""
-    out = parity_to_first[parity] + digits
-    for i in range(0, 42, 7):
-        chunk = right[i:i+7]
-        if chunk not in r:
-            return ""
-        out += r[chunk]
-    return out if is_valid_gtin_check_digit(out) else ""
+    lines = [black[y] for y in np.unique(np.linspace(rows.min(), rows.max(), scanlines).astype(int))]
+    # Band averages survive speckles that break single scanlines.
+    for band in np.array_split(black[rows.min(): rows.max() + 1], EAN13_FALLBACK_BANDS):
+        if len(band):
+            lines.append(band.mean(axis=0) > 0.5)
+    votes = Counter(value for value in map(_scanline_ean13, lines) if value)
+    if not votes:
+        return ""
+    value, count = votes.most_common(1)[0]
+    return value if count >= EAN13_FALLBACK_MIN_VOTES and count * 2 > sum(votes.values()) else ""
 
 
-def detect_code(front=None, back=None) -> tuple[str, str, dict[str, Any]]:
-    debug: dict[str, Any] = {
-        "decoders": decoder_status(), "attempts": [], "errors": [], "raw_values": [],
-        "rejected_checksum_values": [], "dimensions": {}, "exif_orientation_applied": True,
-        "rotations_attempted": [], "crops_attempted": [], "variants_attempted": [],
-    }
-    # The second/back photo is the only image used for barcode detection.
-    for source, image in [("back", back)]:
-        if image is None:
+def _barcode_executor() -> ThreadPoolExecutor:
+    return shared(
+        "barcode_executor",
+        lambda: ThreadPoolExecutor(max_workers=BARCODE_DECODER_WORKERS, thread_name_prefix="barcode"),
+    )
+
+
+_OPENCV_DETECTORS = shared("opencv_detectors", threading.local)
+
+
+def opencv_detector(name: str):
+    """The calling thread's reusable OpenCV detector; instances are not safe to share between threads."""
+    detectors = getattr(_OPENCV_DETECTORS, "detectors", None)
+    if detectors is None:
+        detectors = _OPENCV_DETECTORS.detectors = {}
+    detector = detectors.get(name)
+    if detector is None:
+        detector = cv2.barcode.BarcodeDetector() if name == "opencv_barcode" else cv2.QRCodeDetector()
+        detectors[name] = detector
+    return detector
+
+
+def decode_barcode_variant(decoder_name: str, variant: np.ndarray) -> list[tuple[str, str, str]]:
+    if decoder_name == "pyzbar":
+        return decode_with_pyzbar(variant)
+    if decoder_name == "opencv_barcode":
+        detector = opencv_detector("opencv_barcode")
+        bgr = cv2.cvtColor(variant, cv2.COLOR_RGB2BGR) if variant.ndim == 3 else variant
+        # OpenCV >= 4.8 moved the (ok, values, types, points) result to detectAndDecodeMulti.
+        decode = getattr(detector, "detectAndDecodeMulti", detector.detectAndDecode)
+        ok, decoded_values, _, _ = decode(bgr)
+        if ok and decoded_values is not None:
+            return [("Barcode" if clean(v).isdigit() else "Other", clean(v), "opencv") for v in decoded_values if clean(v)]
+        return []
+    value, _, _ = opencv_detector("opencv_qr").detectAndDecode(variant)
+    return [("QR", clean(value), "opencv_qr")] if clean(value) else []
+
+
+def _timed_decode(decoder_name: str, variant: np.ndarray) -> tuple[list[tuple[str, str, str]], Exception | None, float]:
+    started = time.perf_counter()
+    try:
+        return decode_barcode_variant(decoder_name, variant), None, time.perf_counter() - started
+    except Exception as exc:
+        return [], exc, time.perf_counter() - started
+
+
+# opencv_qr costs as much on a half crop as on the whole photo and finds nothing the complete crop misses.
+BARCODE_HALF_CROPS = {"upper_half", "lower_half", "left_half", "right_half"}
+# Stages of a pyramid level: "quick", then "regions" (localized, cheapest tier), then "sweep" (the rest).
+BARCODE_STAGE_ROTATIONS = {"quick": (0,), "regions": (0, 90)}
+
+
+def _barcode_attempts(
+    image: np.ndarray, source: str, debug: dict[str, Any], gray: np.ndarray | None = None,
+    *, stage: str = "all", regions=None,
+) -> Iterator[tuple]:
+    """Yield (location, rotation, crop, variant name, decoder, variant) lazily, cheapest tier first."""
+    gray = _grayscale(image) if gray is None else gray
+    locate = regions or (lambda rotation, rotated_gray: barcode_regions(rotated_gray))
+    tiers = {"quick": (("original_rgb",),), "regions": BARCODE_VARIANT_TIERS[:1]}.get(stage, BARCODE_VARIANT_TIERS)
+    rotations = BARCODE_STAGE_ROTATIONS.get(stage)
+    for (rotation, rotated), (_, rotated_gray) in zip(barcode_rotations(image), barcode_rotations(gray)):
+        if rotations is not None and rotation not in rotations:
             continue
-        debug["dimensions"][source] = {"width": int(image.shape[1]), "height": int(image.shape[0])}
-        for rotation, rotated in barcode_rotations(image):
+        if f"{source}:{rotation}" not in debug["rotations_attempted"]:
             debug["rotations_attempted"].append(f"{source}:{rotation}")
-            for crop_name, cropped in barcode_crops(rotated):
+        boxes = locate(rotation, rotated_gray)
+        for tier_index, tier in enumerate(tiers):
+            for (crop_name, cropped), (_, cropped_gray) in zip(barcode_crops(rotated, boxes), barcode_crops(rotated_gray, boxes)):
+                localized = crop_name.startswith("region_")
+                if stage == "regions" and not localized:
+                    break
+                if stage == "quick" and not (localized or crop_name == "complete"):
+                    continue
+                if stage == "sweep" and tier_index == 0 and localized and rotation in BARCODE_STAGE_ROTATIONS["regions"]:
+                    continue
                 if cropped.size == 0:
                     continue
-                debug["crops_attempted"].append(f"{source}:{rotation}:{crop_name}")
-                for variant_name, variant in barcode_variants(cropped):
-                    debug["variants_attempted"].append(f"{source}:{rotation}:{crop_name}:{variant_name}")
+                if tier_index == 0:
+                    debug["crops_attempted"].append(f"{source}:{rotation}:{crop_name}")
+                decoders = [name for name in BARCODE_DECODERS if not (name == "opencv_qr" and crop_name in BARCODE_HALF_CROPS)]
+                for variant_name, variant in barcode_variants(cropped, tier, cropped_gray):
                     location = f"{source}:{rotation}:{crop_name}:{variant_name}"
-                    for decoder_name in ("pyzbar", "opencv_barcode", "opencv_qr"):
-                        if len(debug["attempts"]) >= MAX_BARCODE_DECODER_ATTEMPTS:
-                            debug["attempt_limit_reached"] = MAX_BARCODE_DECODER_ATTEMPTS
-                            fallback = decode_ean13_bars_fallback(image)
-                            if fallback:
-                                candidate = classify_barcode_value("Barcode", fallback)
-                                candidate.update({"decoder": "ocr_bar_fallback", "source": "back"})
-                                debug["raw_values"].append(candidate)
-                            selected = choose_detected_code(debug["raw_values"])
-                            debug["selected"] = selected
-                            debug["candidates"] = [c for c in debug["raw_values"] if c.get("valid")]
-                            debug["ambiguous"] = selected.get("ambiguous", False)
-                            return selected.get("type", "Barcode"), selected.get("value", ""), debug
-                        try:
-                            values = []
-                            if decoder_name == "pyzbar":
-                                values = decode_with_pyzbar(variant)
-                            elif decoder_name == "opencv_barcode":
-                                detector = cv2.barcode.BarcodeDetector()
-                                bgr = cv2.cvtColor(variant, cv2.COLOR_RGB2BGR) if variant.ndim == 3 else variant
-                                ok, decoded_values, _, _ = detector.detectAndDecode(bgr)
-                                if ok and decoded_values is not None:
-                                    values = [("Barcode" if clean(v).isdigit() else "Other", clean(v), "opencv") for v in decoded_values if clean(v)]
-                            else:
-                                value, _, _ = cv2.QRCodeDetector().detectAndDecode(variant)
-                                values = [("QR", clean(value), "opencv_qr")] if clean(value) else []
-                            debug["attempts"].append(f"{decoder_name}:{location}:ok:{len(values)}")
-                            for detected_type, value, raw_type in values:
-                                candidate = classify_barcode_value(detected_type, value)
-                                candidate.update({"decoder": decoder_name, "source": source, "rotation": rotation, "crop": crop_name, "variant": variant_name, "raw_type": raw_type})
-                                if candidate.get("checksum") == "invalid":
-                                    debug["rejected_checksum_values"].append(candidate)
-                                debug["raw_values"].append(candidate)
-                            selected = choose_detected_code(debug["raw_values"])
-                            if selected.get("type") == "EAN-13" and selected.get("valid") and not selected.get("ambiguous"):
-                                debug["selected"] = selected
-                                debug["candidates"] = [c for c in debug["raw_values"] if c.get("valid")]
-                                debug["ambiguous"] = False
-                                return selected.get("type", "Barcode"), selected.get("value", ""), debug
-                        except Exception as exc:
-                            debug["attempts"].append(f"{decoder_name}:{location}:failed")
-                            debug["errors"].append(f"{decoder_name} {location}: {exc}")
-    if back is not None:
-        fallback = decode_ean13_bars_fallback(back)
-        if fallback:
-            candidate = classify_barcode_value("Barcode", fallback)
-            candidate.update({"decoder": "ocr_bar_fallback", "source": "back"})
+                    debug["variants_attempted"].append(location)
+                    for decoder_name in decoders:
+                        yield location, rotation, crop_name, variant_name, decoder_name, variant
+
+
+def _record_decode_result(debug: dict[str, Any], source: str, level: str, job: tuple, result: tuple) -> None:
+    location, rotation, crop_name, variant_name, decoder_name, _ = job
+    values, error, seconds = result
+    debug["timings"][decoder_name] += seconds
+    if error is not None:
+        debug["attempts"].append(f"{decoder_name}:{location}:failed")
+        debug["errors"].append(f"{decoder_name} {location}: {error}")
+        return
+    debug["attempts"].append(f"{decoder_name}:{location}:ok:{len(values)}")
+    for detected_type, value, raw_type in values:
+        candidate = classify_barcode_value(detected_type, value)
+        candidate.update({"decoder": decoder_name, "source": source, "pyramid_level": level, "rotation": rotation, "crop": crop_name, "variant": variant_name, "raw_type": raw_type})
+        if candidate.get("checksum") == "invalid":
+            debug["rejected_checksum_values"].append(candidate)
+        debug["raw_values"].append(candidate)
+
+
+def barcode_pyramid(image: np.ndarray, context: dict[str, Any] | None = None) -> list[tuple[str, np.ndarray]]:
+    """Resolution levels to scan, smallest first; small photos are scanned once at full size."""
+    h, w = image.shape[:2]
+    if max(h, w) <= BARCODE_PYRAMID_MAX_SIDE:
+        return [("full", image)]
+    scale = BARCODE_PYRAMID_MAX_SIDE / max(h, w)
+    downscaled = derived_buffer(
+        context, ("downscaled", BARCODE_PYRAMID_MAX_SIDE),
+        lambda: cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA),
+    )
+    return [("downscaled", downscaled), ("full", image)]
+
+
+def _level_gray(context: dict[str, Any] | None, level: str, image: np.ndarray) -> np.ndarray:
+    return derived_buffer(context, ("gray",) if level == "full" else ("downscaled", BARCODE_PYRAMID_MAX_SIDE, "gray"), lambda: _grayscale(image))
+
+
+def _run_barcode_attempts(
+    image: np.ndarray, source: str, level: str, debug: dict[str, Any], limit: int, policy: dict[str, Any],
+    context: dict[str, Any] | None = None, stage: str = "all",
+) -> tuple[bool, int]:
+    """Decode up to limit attempts on the shared pool in order; (early-exit met, attempts used)."""
+    executor = _barcode_executor()
+    def regions(rotation: int, rotated_gray: np.ndarray) -> list[tuple[int, int, int, int]]:
+        return derived_buffer(context, ("barcode_regions", level, rotation), lambda: barcode_regions(rotated_gray))
+
+    location = source if level == "full" else f"{source}@{level}"
+    attempts = _barcode_attempts(image, location, debug, _level_gray(context, level, image), stage=stage, regions=regions)
+    pending: deque = deque()
+    submitted = processed = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < BARCODE_DECODER_WORKERS * 2:
+                if submitted >= limit:
+                    exhausted = True
+                    break
+                started = time.perf_counter()
+                job = next(attempts, None)
+                debug["timings"]["prepare"] += time.perf_counter() - started
+                if job is None:
+                    exhausted = True
+                    break
+                pending.append((job, executor.submit(_timed_decode, job[4], job[5])))
+                submitted += 1
+            if not pending:
+                return False, processed
+            job, future = pending.popleft()
+            _record_decode_result(debug, source, level, job, future.result())
+            processed += 1
+            reason = early_exit_reason(debug["raw_values"], policy)
+            if reason:
+                debug["early_exit"] = reason
+                return True, processed
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def _run_datamatrix_stage(levels: list[tuple[str, np.ndarray]], source: str, debug: dict[str, Any], policy: dict[str, Any]) -> bool:
+    """Try the DataMatrix once per pyramid level; True when the early-exit policy is met."""
+    if not datamatrix_available():
+        return False
+    for level, image in levels:
+        location = source if level == "full" else f"{source}@{level}"
+        started = time.perf_counter()
+        try:
+            values = decode_datamatrix(image)
+        except Exception as exc:
+            debug["attempts"].append(f"datamatrix:{location}:failed")
+            debug["errors"].append(f"datamatrix {location}: {exc}")
+            continue
+        finally:
+            debug["timings"]["datamatrix"] += time.perf_counter() - started
+        debug["attempts"].append(f"datamatrix:{location}:ok:{len(values)}")
+        for value in values:
+            candidate = classify_barcode_value("DataMatrix", value)
+            candidate.update({"decoder": "datamatrix", "source": source, "pyramid_level": level, "raw_type": "DATAMATRIX"})
+            if candidate.get("checksum") == "invalid":
+                debug["rejected_checksum_values"].append(candidate)
             debug["raw_values"].append(candidate)
+        reason = early_exit_reason(debug["raw_values"], policy)
+        if reason:
+            debug.update({"pyramid_level": level, "early_exit": reason})
+            return True
+    return False
+
+
+def _unambiguous_checksum_read(candidates: list[dict[str, Any]]) -> bool:
+    selected = choose_detected_code(candidates)
+    return selected.get("checksum") == "valid" and not selected["ambiguous"]
+
+
+def detect_code(
+    front=None, back=None, *, early_exit: dict[str, Any] | None = None, context: dict[str, Any] | None = None
+) -> tuple[str, str, dict[str, Any]]:
+    """context, an image_context of back, lets later stages reuse the buffers computed here."""
+    started = time.perf_counter()
+    policy = {**BARCODE_EARLY_EXIT, **(early_exit or {})}
+    debug: dict[str, Any] = {
+        "decoders": decoder_status(), "attempts": [], "errors": [], "raw_values": [],
+        "rejected_checksum_values": [], "dimensions": {}, "exif_orientation_applied": True,
+        "rotations_attempted": [], "crops_attempted": [], "variants_attempted": [], "pyramid_level": "", "early_exit": "",
+        "timings": {"datamatrix": 0.0, "prepare": 0.0, **{name: 0.0 for name in BARCODE_DECODERS}, "fallback": 0.0, "total": 0.0},
+    }
+    # The second/back photo is the only image used for barcode detection.
+    if back is not None:
+        debug["dimensions"]["back"] = {"width": int(back.shape[1]), "height": int(back.shape[0])}
+        remaining = MAX_BARCODE_DECODER_ATTEMPTS
+        if context is None:
+            context = image_context(back)
+        levels = barcode_pyramid(back, context)
+        debug["pyramid_attempts"] = {}
+        # A GS1 DataMatrix already carries GTIN, expiry, lot and serial, so it ends the scan.
+        found = datamatrix_fast() and _run_datamatrix_stage(levels[:1], "back", debug, policy)
+        stages = [(level, image, "quick") for level, image in levels if level != "full"]
+        stages += [("full", back, "regions"), ("full", back, "sweep")]
+        escalated = False
+        for level, image, stage in [] if found else stages:
+            if remaining <= 0:
+                break
+            if stage == "sweep" and datamatrix_fast() and not _unambiguous_checksum_read(debug["raw_values"]):
+                escalated = True
+                found = _run_datamatrix_stage(levels[1:], "back", debug, policy)
+                if found:
+                    break
+            found, used = _run_barcode_attempts(image, "back", level, debug, remaining, policy, context, stage)
+            debug["pyramid_attempts"][level] = debug["pyramid_attempts"].get(level, 0) + used
+            remaining -= used
+            if found:
+                debug["pyramid_level"] = level
+                break
+        if not found and remaining <= 0:
+            debug["attempt_limit_reached"] = MAX_BARCODE_DECODER_ATTEMPTS
+        if not found and not escalated and not _unambiguous_checksum_read(debug["raw_values"]):
+            found = _run_datamatrix_stage(levels[1:] if datamatrix_fast() else levels[:1], "back", debug, policy)
+        if not found:
+            fallback_started = time.perf_counter()
+            fallback = decode_ean13_bars_fallback(_level_gray(context, "full", back))
+            debug["timings"]["fallback"] = time.perf_counter() - fallback_started
+            if fallback:
+                candidate = classify_barcode_value("Barcode", fallback)
+                candidate.update({"decoder": "ocr_bar_fallback", "source": "back"})
+                debug["raw_values"].append(candidate)
+                debug["pyramid_level"] = "fallback"
     selected = choose_detected_code(debug["raw_values"])
     debug["selected"] = selected
     debug["candidates"] = [c for c in debug["raw_values"] if c.get("valid")]
     debug["ambiguous"] = selected.get("ambiguous", False)
+    debug["timings"]["total"] = time.perf_counter() - started
+    debug["timings"] = {name: round(seconds, 4) for name, seconds in debug["timings"].items()}
     return selected.get("type", "Barcode"), selected.get("value", ""), debug
 
 
 def tesseract_status() -> dict[str, str]:
+    if tesserocr is not None:
+        return {"available": "yes", "engine": "tesserocr", "version": tesserocr.tesseract_version().splitlines()[0]}
     executable = shutil.which("tesseract")
     if pytesseract is None:
         return {"available": "no", "reason": f"pytesseract import failed: {PYTESSERACT_IMPORT_ERROR}"}
     if not executable:
         return {"available": "no", "reason": "tesseract executable was not found in PATH"}
-    return {"available": "yes", "executable": executable}
+    return {"available": "yes", "engine": "pytesseract", "executable": executable}
+
+
+_TESSEROCR_POOLS: dict[str, dict[str, Any]] = shared("tesserocr_pools", dict)
+_TESSEROCR_POOLS_LOCK = shared("tesserocr_pools_lock", threading.Lock)
+
+
+@contextmanager
+def tesserocr_api(lang: str, wait: float) -> Iterator[Any]:
+    """A pooled Tesseract handle for lang, or None when none is free within wait seconds."""
+    with _TESSEROCR_POOLS_LOCK:
+        pool = _TESSEROCR_POOLS.setdefault(lang, {"idle": queue.LifoQueue(), "created": 0})
+        try:
+            api = pool["idle"].get_nowait()
+        except queue.Empty:
+            api = None
+            create = pool["created"] < TESSEROCR_POOL_SIZE
+            if create:
+                pool["created"] += 1
+    if api is None and create:
+        try:
+            api = tesserocr.PyTessBaseAPI(lang=lang)
+        except RuntimeError as exc:
+            with _TESSEROCR_POOLS_LOCK:
+                pool["created"] -= 1
+            raise OcrEngineError(f"tesserocr could not load {lang}: {exc}") from exc
+    elif api is None:
+        try:
+            api = pool["idle"].get(timeout=wait)
+        except queue.Empty:
+            yield None
+            return
+    try:
+        yield api
+    finally:
+        api.Clear()
+        pool["idle"].put(api)
+
+
+def _pytesseract_to_string(pil: Image.Image, *, lang: str, psm: int, whitelist: str, timeout: int) -> str:
+    if pytesseract is None:
+        raise RuntimeError(f"Tesseract process timeout: no free tesserocr handle and pytesseract unavailable: {PYTESSERACT_IMPORT_ERROR}")
+    config = f"--psm {psm}" + (f" -c tessedit_char_whitelist={whitelist}" if whitelist else "")
+    return pytesseract.image_to_string(pil, lang=lang, config=config, timeout=timeout)
+
+
+def ocr_image_to_string(
+    image: np.ndarray | Image.Image,
+    *,
+    lang: str,
+    psm: int,
+    whitelist: str = "",
+    timeout: int = 8,
+    image_hash: str = "",
+    variant: str = "",
+    cache_stats: dict[str, int] | None = None,
+) -> str:
+    """Tesseract text through tesserocr when installed, otherwise pytesseract; timeouts raise RuntimeError."""
+    if image_hash:
+        return cached_ocr(
+            image_hash, variant, psm, lang,
+            lambda: ocr_image_to_string(image, lang=lang, psm=psm, whitelist=whitelist, timeout=timeout),
+            whitelist=whitelist, stats=cache_stats,
+        )
+    pil = image if isinstance(image, Image.Image) else Image.fromarray(image)
+    if tesserocr is None:
+        return _pytesseract_to_string(pil, lang=lang, psm=psm, whitelist=whitelist, timeout=timeout)
+    with tesserocr_api(lang, wait=timeout) as api:
+        if api is None:
+            return _pytesseract_to_string(pil, lang=lang, psm=psm, whitelist=whitelist, timeout=timeout)
+        api.SetPageSegMode(psm)
+        api.SetVariable("tessedit_char_whitelist", whitelist)
+        api.SetImage(pil)
+        if not api.Recognize(timeout=int(timeout * 1000)):
+            raise RuntimeError("Tesseract process timeout")
+        return api.GetUTF8Text()
 
 
 def _crop_to_content(image: np.ndarray) -> np.ndarray:
@@ -1314,32 +2375,116 @@ def _ocr_attempts(image: np.ndarray) -> list[tuple[str, np.ndarray, int]]:
     return [("front_fast_single_pass", base_gray, 6), ("front_fast_single_pass", base_gray, 11)][:MAX_FRONT_OCR_CALLS]
 
 
-def _expiry_ocr_attempts(image: np.ndarray) -> list[tuple[str, np.ndarray, int]]:
-    pil = ImageOps.exif_transpose(Image.fromarray(image)).convert("L")
-    pil = ImageEnhance.Contrast(pil).enhance(1.8)
-    pil = pil.resize((pil.width * 2, pil.height * 2), Image.Resampling.LANCZOS)
-    gray = np.array(pil)
-    return [
-        ("back_expiry_gray_2x", gray, 6),
-        ("back_expiry_clahe_2x", _clahe(gray), 6),
-        ("back_expiry_threshold_2x", _otsu_threshold(_clahe(gray)), 6),
-        ("back_expiry_sparse_2x", _sharpen(_clahe(gray)), 11),
-    ][:MAX_BACK_EXPIRY_OCR_CALLS]
+def expiry_text_regions(gray: np.ndarray, *, max_side: int = EXPIRY_REGION_MAX_SIDE, limit: int = MAX_EXPIRY_REGION_OCR_CALLS) -> list[tuple[int, int, int, int]]:
+    """Full-resolution (x0, y0, x1, y1) boxes of printed text lines, densest strokes first."""
+    h, w = gray.shape[:2]
+    scale = min(1.0, max_side / max(h, w))
+    small = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 7))
+    strokes = cv2.max(cv2.morphologyEx(small, cv2.MORPH_BLACKHAT, kernel), cv2.morphologyEx(small, cv2.MORPH_TOPHAT, kernel))
+    _, mask = cv2.threshold(strokes, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (17, 3)))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    small_h, small_w = small.shape[:2]
+    scored = []
+    for contour in contours:
+        x, y, bw, bh = cv2.boundingRect(contour)
+        if bh < 6 or bh > small_h * 0.15 or bw < bh * 2 or bw > small_w * 0.95:
+            continue
+        if cv2.countNonZero(mask[y:y + bh, x:x + bw]) < 0.4 * bw * bh:
+            continue
+        scored.append((float(strokes[y:y + bh, x:x + bw].mean()) * (bw * bh) ** 0.5, (x, y, bw, bh)))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    boxes = []
+    for _, (x, y, bw, bh) in scored[:limit]:
+        pad_x, pad_y = bh // 2 + 2, bh // 3 + 2
+        boxes.append((
+            max(0, int((x - pad_x) / scale)),
+            max(0, int((y - pad_y) / scale)),
+            min(w, int((x + bw + pad_x) / scale)),
+            min(h, int((y + bh + pad_y) / scale)),
+        ))
+    return boxes
+
+
+def _expiry_contrast(context: dict[str, Any]) -> np.ndarray:
+    gray = derived_buffer(context, ("gray",), lambda: _grayscale(context["image"]))
+    return derived_buffer(context, ("expiry_contrast",), lambda: np.array(ImageEnhance.Contrast(Image.fromarray(gray)).enhance(1.8)))
+
+
+def _expiry_gray_2x(context: dict[str, Any]) -> np.ndarray:
+    contrast = _expiry_contrast(context)
+    size = (contrast.shape[1] * 2, contrast.shape[0] * 2)
+    return derived_buffer(context, ("expiry_contrast", "2x"), lambda: np.array(Image.fromarray(contrast).resize(size, Image.Resampling.LANCZOS)))
+
+
+def _expiry_clahe_2x(context: dict[str, Any]) -> np.ndarray:
+    upscaled = _expiry_gray_2x(context)
+    return derived_buffer(context, ("expiry_contrast", "2x", "clahe"), lambda: _clahe(upscaled))
+
+
+def _expiry_threshold_2x(context: dict[str, Any]) -> np.ndarray:
+    clahe = _expiry_clahe_2x(context)
+    return derived_buffer(context, ("expiry_contrast", "2x", "otsu"), lambda: _otsu_threshold(clahe))
+
+
+def _expiry_sparse_2x(context: dict[str, Any]) -> np.ndarray:
+    return _sharpen(_expiry_clahe_2x(context))
+
+
+EXPIRY_FULL_IMAGE_VARIANTS = (
+    ("back_expiry_gray_2x", _expiry_gray_2x, 6),
+    ("back_expiry_clahe_2x", _expiry_clahe_2x, 6),
+    ("back_expiry_threshold_2x", _expiry_threshold_2x, 6),
+    ("back_expiry_sparse_2x", _expiry_sparse_2x, 11),
+)
+
+
+def _expiry_ocr_attempts(context: dict[str, Any], debug: dict[str, Any] | None = None) -> Iterator[tuple[str, np.ndarray, int]]:
+    # Small single-line crops first; the full-image variants are only built when none of them yields a date.
+    contrast = _expiry_contrast(context)
+    regions = derived_buffer(context, ("expiry_contrast", "regions"), lambda: expiry_text_regions(contrast))
+    if debug is not None:
+        debug["expiry_regions"] = regions
+    for index, (x0, y0, x1, y1) in enumerate(regions, start=1):
+        crop = cv2.resize(contrast[y0:y1, x0:x1], None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+        yield f"back_expiry_region_{index}_2x", _clahe(crop), 7
+    # The crops already read the text lines at CLAHE 2x, so after them one full-image pass per psm is enough.
+    seen_psms: set[int] = set()
+    for variant_name, build, psm in EXPIRY_FULL_IMAGE_VARIANTS[:MAX_BACK_EXPIRY_OCR_CALLS]:
+        if regions and psm in seen_psms:
+            continue
+        seen_psms.add(psm)
+        yield variant_name, build(context), psm
 
 
-def detect_back_expiry_ocr(image: np.ndarray | None, image_hash: str = "") -> tuple[dict[str, str], list[str], dict[str, Any]]:
+def detect_back_expiry_ocr(
+    image: np.ndarray | None, image_hash: str = "", context: dict[str, Any] | None = None
+) -> tuple[dict[str, str], list[str], dict[str, Any]]:
     debug = _empty_ocr_debug()
-    debug.update({"language": "eng", "psm_modes": [6, 11], "image_hash": image_hash, "ocr_kind": "back_expiry_only"})
+    debug.update({"language": "eng", "psm_modes": [7, 6, 11], "image_hash": image_hash, "ocr_kind": "back_expiry_only"})
     if image is None or debug["ocr"].get("available") != "yes":
         return {"expiry_date": ""}, [], debug
+    if context is None:
+        context = image_context(image)
     whitelist = "0123456789/-. EXPIRYEXPΛΗΞΗ: "
     best_text = ""
     lines: list[str] = []
-    for variant_name, variant, psm in _expiry_ocr_attempts(image):
+    deadline = time.monotonic() + BACK_EXPIRY_OCR_DEADLINE_SECONDS
+    attempts = _expiry_ocr_attempts(context, debug)
+    for variant_name, variant, psm in islice(attempts, MAX_BACK_EXPIRY_TOTAL_OCR_CALLS):
         label = f"{variant_name}_psm{psm}"
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            debug["attempts"].append(f"tesseract:{label}:deadline")
+            debug["timed_out"] = True
+            break
         try:
-            config = f"--psm {psm} -c tessedit_char_whitelist={whitelist}"
-            text = pytesseract.image_to_string(Image.fromarray(variant), lang="eng", config=config, timeout=BACK_OCR_TIMEOUT_SECONDS)
+            text = ocr_image_to_string(
+                variant, lang="eng", psm=psm, whitelist=whitelist, timeout=min(BACK_OCR_TIMEOUT_SECONDS, remaining),
+                image_hash=image_hash, variant=variant_name, cache_stats=debug["ocr_cache"],
+            )
             variant_lines = [clean(line) for line in text.splitlines() if clean(line)]
             debug["attempts"].append(f"tesseract:{label}:ok:{len(variant_lines)}")
             debug["variant_results"].append({"variant": variant_name, "psm": psm, "raw_text": text})
@@ -1351,6 +2496,11 @@ def detect_back_expiry_ocr(image: np.ndarray | None, image_hash: str = "") -> tu
             if fields.get("expiry_date"):
                 debug.update({"raw_text": text, "variant_used": label, "selected_candidate": fields["expiry_date"]})
                 return {"expiry_date": fields["expiry_date"]}, variant_lines, debug
+        except OcrEngineError as exc:
+            debug["attempts"].append(f"tesseract:{label}:engine_failed")
+            debug["errors"].append(f"tesseract {label}: {exc}")
+            debug["ocr"] = {"available": "no", "reason": str(exc)}
+            break
         except RuntimeError as exc:
             debug["attempts"].append(f"tesseract:{label}:timeout")
             debug["errors"].append(f"tesseract {label}: {exc}")
@@ -1370,10 +2520,8 @@ def _has_useful_alphabetic_text(text: str) -> bool:
     return alpha >= 8 and len(words) >= 2
 
 
-def _ocr_text(variant: np.ndarray, psm: int, timeout: int = 8) -> str:
-    pil = Image.fromarray(variant)
-    config = f"--psm {psm}"
-    return pytesseract.image_to_string(pil, lang="ell+eng", config=config, timeout=timeout)
+def _ocr_text(variant: np.ndarray, psm: int, timeout: int = 8, *, image_hash: str = "", variant_name: str = "", cache_stats: dict[str, int] | None = None) -> str:
+    return ocr_image_to_string(variant, lang="ell+eng", psm=psm, timeout=timeout, image_hash=image_hash, variant=variant_name, cache_stats=cache_stats)
 
 
 def _ocr_score(text: str, words: list[dict[str, Any]], avg_conf: float | None) -> tuple[int, float, int]:
@@ -1428,7 +2576,7 @@ def extract_front_fields(lines: list[str], words: list[dict[str, Any]]) -> dict[
     return fields
 
 
-def detect_product_name(image, deadline: float | None = None) -> tuple[dict[str, Any], list[str], dict[str, Any]]:
+def detect_product_name(image, deadline: float | None = None, image_hash: str = "") -> tuple[dict[str, Any], list[str], dict[str, Any]]:
     debug = _empty_ocr_debug()
     if image is None or debug["ocr"].get("available") != "yes":
         return {}, [], debug
@@ -1441,7 +2589,7 @@ def detect_product_name(image, deadline: float | None = None) -> tuple[dict[str,
         label = f"{variant_name}_psm{psm}"
         try:
             remaining = max(1, int(deadline - time.monotonic())) if deadline is not None else 8
-            text = _ocr_text(variant, psm, timeout=min(8, remaining))
+            text = _ocr_text(variant, psm, timeout=min(8, remaining), image_hash=image_hash, variant_name=variant_name, cache_stats=debug["ocr_cache"])
             words: list[dict[str, Any]] = []
             avg_conf = None
             variant_lines = [clean(line) for line in text.splitlines() if clean(line)]
@@ -1454,6 +2602,11 @@ def detect_product_name(image, deadline: float | None = None) -> tuple[dict[str,
                 best = (score, variant_name, psm, text, words, variant_lines, avg_conf)
             if _has_useful_alphabetic_text(text):
                 break
+        except OcrEngineError as exc:
+            debug["attempts"].append(f"tesseract:{label}:engine_failed")
+            debug["errors"].append(f"tesseract {label}: {exc}")
+            debug["ocr"] = {"available": "no", "reason": str(exc)}
+            break
         except RuntimeError as exc:
             debug["attempts"].append(f"tesseract:{label}:timeout")
             debug["errors"].append(f"tesseract {label}: {exc}")
@@ -1479,12 +2632,17 @@ def uploaded_file_data_url(file) -> str:
 
 
 def analyze_back_photo(back_image, back_hash: str) -> dict[str, Any]:
-    detected_type, detected_code, barcode_debug = detect_code(None, back_image)
+    context = image_context(back_image) if back_image is not None else None
+    detected_type, detected_code, barcode_debug = detect_code(None, back_image, context=context)
     parsed_gs1 = parse_machine_readable_fields(detected_code) if detected_type in {"QR", "DataMatrix"} and detected_code else {}
     expiry_fields: dict[str, str] = {"expiry_date": ""}
     expiry_debug = _empty_ocr_debug()
-    if back_image is not None:
-        expiry_fields, _back_lines, expiry_debug = detect_back_expiry_ocr(back_image, back_hash)
+    if parsed_gs1.get("expiry_date"):
+        expiry_debug["skipped"] = "expiry_from_machine_readable_code"
+    elif back_image is not None:
+        expiry_fields, _back_lines, expiry_debug = detect_back_expiry_ocr(back_image, back_hash, context=context)
+    if context is not None:
+        expiry_debug["preprocessing"] = dict(context["stats"])
     return {
         "type": detected_type,
         "barcode": detected_code if detected_type == "Barcode" else "",
@@ -1513,7 +2671,7 @@ def run_photo_analysis(front_image, back_image, front_hash: str, back_hash: str)
         return
 
     progress = st.progress(0, text="Αναλύεται η δεύτερη φωτογραφία...")
-    result = analyze_back_photo(back_image, back_hash)
+    result = cached_analysis("back_photo", back_hash, lambda: analyze_back_photo(back_image, back_hash))
     apply_back_scan_result(st.session_state, back_hash, result)
     detected_type = result.get("type", "Barcode")
     detected_code = result.get("raw_code") or result.get("gtin") or result.get("barcode", "")
@@ -1540,6 +2698,8 @@ def run_photo_analysis(front_image, back_image, front_hash: str, back_hash: str)
     st.session_state.back_image_hash = back_hash
     st.session_state.analysis_ran = True
     st.session_state.analysis_timed_out = bool(front_debug.get("timed_out") or back_debug.get("timed_out"))
+    while len(cache) >= 8:
+        cache.pop(next(iter(cache)))
     cache[cache_key] = {
         "barcode_result": st.session_state.barcode_result,
         "front_ocr_result": st.session_state.front_ocr_result,
@@ -2322,7 +3482,7 @@ def main():
             st.session_state.lookup_expiry_result = detected_expiry
             st.session_state.lookup_ocr_result = {"back": back_result}
 
-        stock_for_lookup = stock_table(app_data)
+        stock_for_lookup = cached_stock_table(app_data)
         local_product = lookup_local_database(stock_for_lookup, lookup_code, parsed_gs1) if clean(lookup_code) else None
         st.session_state.local_lookup_debug = "found" if local_product else "not_found" if clean(lookup_code) else "no_code"
         if should_run_online_lookup(lookup_code, local_product):
@@ -2509,14 +3669,14 @@ def main():
         if current_query != st.session_state.get("lookup_last_search_value", ""):
             reset_lookup_state(preserve={"lookup_last_search_value": current_query, "lookup_query": current_query})
         try:
-            data, unknown = app_data.copy(deep=True), app_unknown
+            data, unknown = app_data.copy(deep=False), app_unknown
         except Exception as exc:
             st.error(f"Google Sheets error: {type(exc).__name__}: {exc}")
             data = empty_dataframe()
             unknown = []
         if unknown:
             st.warning("Άγνωστες στήλες στο Sheet: " + ", ".join(unknown))
-        stock = stock_table(data)
+        stock = cached_stock_table(data)
         results, message = search_stock(stock, current_query) if current_query else (stock.iloc[0:0], "")
         if current_query and message:
             st.info(message)
@@ -2576,10 +3736,10 @@ def main():
         st.dataframe(results, use_container_width=True)
 
     with reports_tab:
-        data, unknown = app_data.copy(deep=True), app_unknown
+        data, unknown = app_data.copy(deep=False), app_unknown
         if unknown:
             st.warning("Άγνωστες στήλες στο Sheet: " + ", ".join(unknown))
-        stock = stock_table(data)
+        stock = cached_stock_table(data)
         reports = expiry_reports(stock)
         labels = {
             "expired products": "Expired products",
@@ -2598,7 +3758,7 @@ def main():
             st.dataframe(selected, use_container_width=True)
 
     with sales_tab:
-        data, _ = app_data.copy(deep=True), app_unknown
+        data, _ = app_data.copy(deep=False), app_unknown
         data = active_movements(data)
         data["Timestamp_dt"] = pd.to_datetime(data["Timestamp"], errors="coerce")
         start_col, end_col = st.columns(2)
@@ -2614,20 +3774,22 @@ def main():
                 sales.groupby(
                     ["CodeType", "CodeValue", "PCCode", "SerialNumber", "Μάρκα", "Προϊόν", "Τοποθεσία"],
                     dropna=False,
+                    observed=True,
                 )["Πωλήθηκαν"]
                 .sum().reset_index().sort_values("Πωλήθηκαν", ascending=False)
             )
             st.dataframe(report, use_container_width=True)
 
     with data_tab:
-        data, unknown = app_data.copy(deep=True), app_unknown
+        data, unknown = app_data.copy(deep=False), app_unknown
         if unknown:
             st.warning("Άγνωστες στήλες στο Sheet: " + ", ".join(unknown))
         st.dataframe(data, use_container_width=True)
 
     with reversal_tab:
-        data, _ = app_data.copy(deep=True), app_unknown
-        candidates = reversible_rows(data)
+        data, _ = app_data.copy(deep=False), app_unknown
+        index = ledger_transaction_index(ws, data)
+        candidates = reversible_rows(data, index)
         if candidates.empty:
             st.info("Δεν υπάρχουν διαθέσιμες κινήσεις για αναστροφή.")
         else:
@@ -2636,8 +3798,8 @@ def main():
                 "Επίλεξε κίνηση",
                 tx_ids,
                 format_func=lambda txid: (
-                    f"{candidates.loc[candidates['TransactionId'].eq(txid), 'Ημερομηνία'].iloc[0]} | "
-                    f"{candidates.loc[candidates['TransactionId'].eq(txid), 'Προϊόν'].iloc[0]} | {txid}"
+                    f"{data['Ημερομηνία'].iat[index['positions'][txid]]} | "
+                    f"{data['Προϊόν'].iat[index['positions'][txid]]} | {txid}"
                 ),
             )
             reason = st.text_input("Λόγος αναστροφής")
@@ -2647,7 +3809,7 @@ def main():
                     st.error("Χρειάζεται επιβεβαίωση.")
                 else:
                     try:
-                        original = candidates[candidates["TransactionId"].eq(selected_id)].iloc[0]
+                        original = data.iloc[index["positions"][selected_id]]
                         status = append_reversal(ws, original, reason)
                         if status == "duplicate":
                             st.info("Η κίνηση έχει ήδη αναστραφεί.")
@@ -33,7 +33,7 @@ def up(x):
 def load_data():
     ws = core.worksheet()
     data, _ = core.load_data_cached(ws)
-    return data.copy(deep=True)
+    return data
 
 
 def stock_by_code(data, code):
@@ -97,11 +97,14 @@ def encode_uploaded_photo(uploaded_file, photo_kind):
 def scan_code_from_photo(uploaded_file):
     if not uploaded_file:
         return {"code": "", "raw": "", "type": "", "gtin": "", "debug": {}}
-    try:
+    def decode():
         image = core.to_img(uploaded_file)
         if image is None:
             raise core.InventoryError("Δεν μπόρεσα να διαβάσω τη φωτογραφία QR / barcode.")
-        detected_type, raw_value, debug = core.detect_code(back=image)
+        return core.detect_code(back=image)
+
+    try:
+        detected_type, raw_value, debug = core.cached_analysis("detect_code", core.file_hash(uploaded_file), decode)
     except Exception as exc:
         return {"code": "", "raw": "", "type": "", "gtin": "", "debug": {"error": str(exc)}}
     selected = debug.get("selected", {}) if isinstance(debug, dict) else {}
@@ -497,8 +500,18 @@ def shelf_photo_tab(data):
         if uploaded_files:
             st.image(uploaded_files, width=180)
             if st.button("Ανάλυση φωτογραφιών με OCR", key="analyze_shelf_photos"):
-                with st.spinner("Διαβάζω ονόματα, πιθανές ποσότητες, barcode/QR και ημερομηνίες..."):
-                    draft_df, debug = shelf_ai.suggest_shelf_inventory(core, uploaded_files)
+                progress = st.progress(0.0, text="Διαβάζω ονόματα, πιθανές ποσότητες, barcode/QR και ημερομηνίες...")
+                preview = st.empty()
+                results = []
+                for photo_rows, photo_debug in shelf_ai.iter_shelf_inventory(core, uploaded_files):
+                    results.append((photo_rows, photo_debug))
+                    progress.progress(len(results) / len(uploaded_files), text=f"Έτοιμες {len(results)}/{len(uploaded_files)} φωτογραφίες")
+                    preview.dataframe(shelf_ai.shelf_dataframe([row for rows, _ in results for row in rows]), hide_index=True, use_container_width=True)
+                progress.empty()
+                preview.empty()
+                results.sort(key=lambda result: result[1]["photo_index"])
+                draft_df = shelf_ai.shelf_dataframe([row for rows, _ in results for row in rows])
+                debug = [photo_debug for _, photo_debug in results]
                 st.session_state["shelf_draft_df"] = draft_df
                 st.session_state["shelf_debug"] = debug
                 st.success(f"Βρέθηκαν {len(draft_df)} πιθανές γραμμές. Μην το πιστέψεις τυφλά, είναι OCR, όχι φαρμακοποιός.")
@@ -526,21 +539,27 @@ def shelf_photo_tab(data):
             else:
                 saved = 0
                 skipped = 0
-                ws = core.worksheet()
+                rows = []
                 for _, item in edited.iterrows():
                     if not bool(item.get("confirm", False)) or not clean(item.get("ProductName", "")):
                         skipped += 1
                         continue
                     try:
-                        row = make_shelf_row(item, location_id, source_note="source=chatgpt_or_shelf_photo_review")
-                        core.append_stock_transaction(ws, row)
+                        rows.append(make_shelf_row(item, location_id, source_note="source=chatgpt_or_shelf_photo_review"))
+                    except Exception as exc:
+                        st.warning(f"Δεν αποθηκεύτηκε γραμμή {clean(item.get('ProductName', ''))}: {exc}")
+                try:
+                    statuses = core.append_stock_transactions(core.worksheet(), rows)
+                    saved_rows = [row for row, status in zip(rows, statuses) if status != "duplicate"]
+                    saved = len(saved_rows)
+                    skipped += len(rows) - saved
+                    if saved_rows:
                         try:
-                            base_db.upsert_product_from_transaction(core, row)
+                            base_db.sync_products_from_transactions(core, pd.DataFrame(saved_rows))
                         except Exception:
                             pass
-                        saved += 1
-                    except Exception as exc:
-                        st.warning(f"Δεν αποθηκεύτηκε γραμμή {clean(item.get('ProductName', ''))}: {exc}")
+                except Exception as exc:
+                    st.warning(f"Δεν αποθηκεύτηκαν οι γραμμές: {exc}")
                 core.invalidate_data_cache()
                 st.success(f"Αποθηκεύτηκαν {saved} γραμμές. Παραλείφθηκαν {skipped}.")
                 st.rerun()
@@ -549,7 +568,7 @@ def shelf_photo_tab(data):
 def quick_update_tab(data):
     st.subheader("🔄 Γρήγορη ενημέρωση stock")
     st.caption("Για καθημερινή χρήση: βρίσκεις προϊόν, διαλέγεις τοποθεσία και πατάς -1/+1 ή δική σου ποσότητα. Επιτέλους, όχι φόρμα-μαμούθ για ένα κουτί.")
-    stock = stock_table(data)
+    stock = core.cached_ledger_view(data, stock_table)
     query = st.text_input("Αναζήτηση προϊόντος", placeholder="π.χ. DEPON, BRIVIACT, 520...", key="quick_query")
     location_choice = st.selectbox("Τοποθεσία που ενημερώνεις", ["2 - Πάνω / Επίπεδο 1", "0 - Αποθήκη", "1 - Κάτω / Κύριο Κτήριο"], key="quick_location")
     location_id = int(location_choice.split("-", 1)[0].strip())
@@ -593,7 +612,7 @@ def quick_update_tab(data):
 
 
 def stock_tab(data):
-    stock = stock_table(data)
+    stock = core.cached_ledger_view(data, stock_table)
     st.subheader("📦 Stock ανά τοποθεσία")
     st.caption("Για το stock πάνω, άσε επιλεγμένο το Πάνω / Επίπεδο 1. Τα προϊόντα εμφανίζονται αλφαβητικά, γιατί το χάος έχει ήδη αρκετούς εκπροσώπους.")
     choices = ["2 - Πάνω / Επίπεδο 1", "Όλες", "0 - Αποθήκη", "1 - Κάτω / Κύριο Κτήριο"]
@@ -615,7 +634,7 @@ def stock_tab(data):
 
 
 def expiry_tab(data):
-    stock = stock_table(data)
+    stock = core.cached_ledger_view(data, stock_table)
     if stock.empty:
         st.info("Δεν υπάρχει stock.")
         return
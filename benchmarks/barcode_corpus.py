@@ -0,0 +1,186 @@
+"""Synthetic barcode corpus and latency/hit-rate benchmark for detect_code.
+
+    python benchmarks/barcode_corpus.py
+    python benchmarks/barcode_corpus.py --large --repeat 3
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Any
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app_inventory_search as core  # noqa: E402
+
+try:
+    import zxingcpp
+except Exception:
+    zxingcpp = None
+
+
+EAN13_VALUES = ["5206087700016", "4006381333931", "5201263086038"]
+EAN8_VALUES = ["96385074", "40170725"]
+GS1_PAYLOAD = "0105206087700016172712311012345A\x1d21SER999"
+QR_PAYLOAD = "(01)05206087700016(17)271231(10)LOT42"
+
+
+def ean13_bits(digits: str) -> str:
+    left_codes = dict(zip("0123456789", core._EAN_L_CODES))
+    g_codes = dict(zip("0123456789", core._EAN_G_CODES))
+    right_codes = dict(zip("0123456789", core._EAN_R_CODES))
+    parity = {first: pattern for pattern, first in core._EAN_PARITY_TO_FIRST.items()}[digits[0]]
+    bits = "101"
+    for digit, side in zip(digits[1:7], parity):
+        bits += (left_codes if side == "L" else g_codes)[digit]
+    bits += "01010" + "".join(right_codes[digit] for digit in digits[7:]) + "101"
+    return bits
+
+
+def ean8_bits(digits: str) -> str:
+    left_codes = dict(zip("0123456789", core._EAN_L_CODES))
+    right_codes = dict(zip("0123456789", core._EAN_R_CODES))
+    return "101" + "".join(left_codes[d] for d in digits[:4]) + "01010" + "".join(right_codes[d] for d in digits[4:]) + "101"
+
+
+def render_bars(bits: str, module: int = 2, height: int = 90, quiet: int = 12) -> np.ndarray:
+    """Bars with a light lens blur; perfectly sharp synthetic edges trip up the OpenCV detector."""
+    row = np.repeat(np.array([0 if bit == "1" else 255 for bit in bits], dtype=np.uint8), module)
+    row = np.pad(row, quiet * module, constant_values=255)
+    image = np.tile(row, (height, 1))
+    image = np.pad(image, ((quiet * 2, quiet * 2), (0, 0)), constant_values=255)
+    return cv2.cvtColor(cv2.GaussianBlur(image, (3, 3), 0), cv2.COLOR_GRAY2RGB)
+
+
+def render_matrix(modules: np.ndarray, scale: int = 6, quiet: int = 4) -> np.ndarray:
+    image = cv2.resize(modules, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+    image = np.pad(image, quiet * scale, constant_values=255)
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+
+
+def render_qr(payload: str) -> np.ndarray:
+    return render_matrix(cv2.QRCodeEncoder.create().encode(payload))
+
+
+def render_datamatrix(payload: str) -> np.ndarray | None:
+    if zxingcpp is None:
+        return None
+    image = np.array(zxingcpp.create_barcode(payload, zxingcpp.BarcodeFormat.DataMatrix).to_image(scale=6))
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB) if image.ndim == 2 else image
+
+
+def rotate(image: np.ndarray, degrees: float) -> np.ndarray:
+    h, w = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), degrees, 1.0)
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    size = (int(h * sin + w * cos), int(h * cos + w * sin))
+    matrix[0, 2] += size[0] / 2 - w / 2
+    matrix[1, 2] += size[1] / 2 - h / 2
+    return cv2.warpAffine(image, matrix, size, borderValue=(255, 255, 255))
+
+
+def on_photo(image: np.ndarray, long_side: int = 4000) -> np.ndarray:
+    """Place the code on a grey 4:3 'phone photo' canvas so resolution-dependent costs show up."""
+    canvas = np.full((long_side * 3 // 4, long_side, 3), 225, dtype=np.uint8)
+    h, w = image.shape[:2]
+    y, x = canvas.shape[0] // 2 - h // 2, canvas.shape[1] // 3 - w // 2
+    canvas[y:y + h, x:x + w] = image
+    return canvas
+
+
+DISTORTIONS = {
+    "clean": lambda image: image,
+    "rotated_90": lambda image: np.ascontiguousarray(np.rot90(image)),
+    "rotated_12": lambda image: rotate(image, 12),
+    "blurred": lambda image: cv2.GaussianBlur(image, (5, 5), 0),
+    "low_contrast": lambda image: (image.astype(np.float32) * 0.35 + 140).astype(np.uint8),
+}
+
+
+def synthetic_corpus(*, large: bool = False) -> list[dict[str, Any]]:
+    """Samples as dicts with name, kind, expected value and image."""
+    sources = [("EAN-13", value, render_bars(ean13_bits(value))) for value in EAN13_VALUES]
+    sources += [("EAN-8", value, render_bars(ean8_bits(value))) for value in EAN8_VALUES]
+    sources.append(("QR", QR_PAYLOAD, render_qr(QR_PAYLOAD)))
+    datamatrix = render_datamatrix(GS1_PAYLOAD)
+    if datamatrix is not None:
+        sources.append(("DataMatrix", "05206087700016", datamatrix))
+    samples = []
+    for kind, expected, image in sources:
+        for distortion, apply in DISTORTIONS.items():
+            distorted = apply(image)
+            samples.append({"name": f"{kind}:{expected}:{distortion}", "kind": kind, "expected": expected, "image": distorted})
+            if large:
+                samples.append({"name": f"{kind}:{expected}:{distortion}:12mp", "kind": kind, "expected": expected, "image": on_photo(distorted)})
+    return samples
+
+
+def decoded_matches(sample: dict[str, Any], value: str, debug: dict[str, Any]) -> bool:
+    if sample["kind"] == "DataMatrix":
+        return debug.get("selected", {}).get("gtin") == sample["expected"]
+    return value == sample["expected"]
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def run_benchmark(samples: list[dict[str, Any]], *, repeat: int = 1, early_exit: dict[str, Any] | None = None) -> dict[str, Any]:
+    results = []
+    for sample in samples:
+        latencies = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            _, value, debug = core.detect_code(None, sample["image"], early_exit=early_exit)
+            latencies.append(time.perf_counter() - started)
+        results.append({
+            "name": sample["name"],
+            "kind": sample["kind"],
+            "decoded": decoded_matches(sample, value, debug),
+            "seconds": min(latencies),
+            "attempts": len(debug["attempts"]),
+            "pyramid_level": debug.get("pyramid_level", ""),
+        })
+    latencies = [result["seconds"] for result in results]
+    return {
+        "samples": len(results),
+        "success_rate": sum(result["decoded"] for result in results) / len(results) if results else 0.0,
+        "median_ms": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "median_attempts": statistics.median(result["attempts"] for result in results) if results else 0,
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--large", action="store_true", help="also place every sample on a 12 MP canvas")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    report = run_benchmark(synthetic_corpus(large=args.large), repeat=args.repeat)
+    if args.verbose:
+        for result in report["results"]:
+            status = "ok  " if result["decoded"] else "MISS"
+            print(f"{status} {result['seconds'] * 1000:8.1f} ms {result['attempts']:4d} attempts  {result['name']}")
+    kinds = sorted({result["kind"] for result in report["results"]})
+    for kind in kinds:
+        subset = [result for result in report["results"] if result["kind"] == kind]
+        hits = sum(result["decoded"] for result in subset)
+        print(f"{kind:<11} {hits}/{len(subset)} decoded")
+    print(
+        f"samples: {report['samples']}  success: {report['success_rate']:.0%}  "
+        f"median: {report['median_ms']:.1f} ms  p95: {report['p95_ms']:.1f} ms  "
+        f"median attempts: {report['median_attempts']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
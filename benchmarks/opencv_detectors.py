@@ -0,0 +1,52 @@
+"""Cost of constructing OpenCV barcode/QR detectors versus decoding with pooled ones.
+
+    python benchmarks/opencv_detectors.py --rounds 50
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app_inventory_search as core  # noqa: E402
+
+
+def best_of(repeat: int, func) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def construct_detectors() -> None:
+    core.cv2.barcode.BarcodeDetector()
+    core.cv2.QRCodeDetector()
+
+
+def pooled_decode(variant: np.ndarray) -> None:
+    core.decode_barcode_variant("opencv_barcode", variant)
+    core.decode_barcode_variant("opencv_qr", variant)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    variant = np.full((240, 320), 255, dtype=np.uint8)
+    pooled_decode(variant)  # warm the calling thread's detectors
+    construct = best_of(args.repeat, lambda: [construct_detectors() for _ in range(args.rounds)]) / args.rounds
+    decode = best_of(args.repeat, lambda: [pooled_decode(variant) for _ in range(args.rounds)]) / args.rounds
+    print(f"construct barcode + QR detectors: {construct * 1000:.2f} ms")
+    print(f"pooled decode, one attempt each:  {decode * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
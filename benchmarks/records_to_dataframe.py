@@ -0,0 +1,88 @@
+"""Load-time benchmark for records_to_dataframe on a synthetic ledger.
+
+    python benchmarks/records_to_dataframe.py --rows 50000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app_inventory_search as core  # noqa: E402
+
+
+PRODUCTS = [f"  depon   {index}  " for index in range(400)]
+BRANDS = ["bayer", "pfizer ", " sanofi", "uni-pharma", "  galenica"]
+STRENGTHS = ["500 mg", "1 g", "20mcg", "5 ml", "1000 iu", ""]
+FORMS = ["tabs", "caps", " syrup ", "cream", ""]
+
+
+def synthetic_records(rows: int, seed: int = 7) -> list[dict]:
+    rng = random.Random(seed)
+    records = []
+    for index in range(rows):
+        code = str(rng.randrange(10**12, 10**13))
+        records.append({
+            "TransactionId": f"tx-{index}",
+            "Timestamp": "2024-01-01T10:00:00",
+            "Ημερομηνία": "2024-01-01 10:00:00",
+            "CodeType": "Barcode",
+            "CodeValue": code,
+            "Barcode": code,
+            "Strength": rng.choice(STRENGTHS),
+            "DosageForm": rng.choice(FORMS),
+            "Μάρκα": rng.choice(BRANDS),
+            "Προϊόν": rng.choice(PRODUCTS),
+            "Κατηγορία": "Φάρμακα",
+            "LocationId": rng.randrange(4),
+            "Τοποθεσία": "Σπίτι",
+            "Κίνηση": "Είσοδος (+)",
+            "Ποσότητα": 1,
+            "DeltaQty": rng.choice([1, 1, 2, -1]),
+            "Voided": rng.choice(["FALSE", "FALSE", "TRUE", ""]),
+            "MovementKind": core.NORMAL,
+        })
+    return records
+
+
+def per_row_normalization(df):
+    # The previous row-by-row implementation, kept for comparison.
+    df["Προϊόν"] = df["Προϊόν"].map(lambda value: core.normalize_spaces(value).upper())
+    df["Μάρκα"] = df["Μάρκα"].map(lambda value: core.normalize_spaces(value).upper())
+    df["DosageForm"] = df["DosageForm"].map(lambda value: core.normalize_spaces(value).upper())
+    df["Strength"] = df["Strength"].map(core.normalize_strength)
+    df["Voided"] = df["Voided"].map(core.normalize_bool)
+    return df
+
+
+def best_of(repeat: int, func) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    records = synthetic_records(args.rows)
+    raw = pd.DataFrame(records)
+    per_row = best_of(args.repeat, lambda: per_row_normalization(raw.copy()))
+    total = best_of(args.repeat, lambda: core.records_to_dataframe(records))
+    print(f"rows: {args.rows}")
+    print(f"per-row normalization only: {per_row * 1000:.1f} ms")
+    print(f"records_to_dataframe total:  {total * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -33,8 +33,11 @@ def suggest_fields(core, front_file=None, back_file=None, scan_result=None) -> d
         old_calls = getattr(core, "MAX_FRONT_OCR_CALLS", 0)
         try:
             core.MAX_FRONT_OCR_CALLS = 2
-            image = core.to_img(front_file)
-            fields, _lines, _debug = core.detect_product_name(image)
+            fields, _lines, _debug = core.cached_analysis(
+                "front_product_name:2",
+                file_hash(front_file),
+                lambda: core.detect_product_name(core.to_img(front_file), image_hash=file_hash(front_file)),
+            )
             output["product"] = clean(fields.get("product_name") or fields.get("candidate", ""))
             output["brand"] = clean(fields.get("brand", ""))
             output["strength"] = clean(fields.get("strength", ""))
@@ -55,8 +58,12 @@ def suggest_fields(core, front_file=None, back_file=None, scan_result=None) -> d
 
     if back_file and not output["expiry"]:
         try:
-            image = core.to_img(back_file)
-            fields, _lines, _debug = core.detect_back_expiry_ocr(image, file_hash(back_file))
+            back_hash = file_hash(back_file)
+            fields, _lines, _debug = core.cached_analysis(
+                "back_expiry_ocr",
+                back_hash,
+                lambda: core.detect_back_expiry_ocr(core.to_img(back_file), back_hash),
+            )
             output["expiry"] = clean(fields.get("expiry_date", ""))
         except Exception:
             pass
@@ -0,0 +1,17 @@
+"""Process-wide objects that must outlive a Streamlit rerun, which re-executes the app script."""
+
+import threading
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+_OBJECTS: dict[str, Any] = {}
+_OBJECTS_LOCK = threading.Lock()
+
+
+def shared(name: str, factory: Callable[[], T]) -> T:
+    """The process-wide object registered under name, created by factory() on first use."""
+    with _OBJECTS_LOCK:
+        if name not in _OBJECTS:
+            _OBJECTS[name] = factory()
+        return _OBJECTS[name]
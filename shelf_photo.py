@@ -1,9 +1,14 @@
 import hashlib
 import re
-from typing import Any
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Iterator
 
 import pandas as pd
 
+from shared_state import shared
+
 STOP_TOKENS = {
     "δισκία", "δισκια", "καψάκια", "καψακια", "επικαλυμμένα", "επικαλυμμενα",
     "με", "λεπτό", "λεπτο", "υμένιο", "υμενιο", "χρήση", "χρηση", "δόση", "δοση",
@@ -11,6 +16,11 @@ STOP_TOKENS = {
     "mg", "mcg", "ml", "iu", "caps", "tabs", "film", "coated",
 }
 
+SHELF_OCR_PSM_MODES = (6, 11)
+SHELF_OCR_WORKERS = 4
+SHELF_OCR_TIME_BUDGET_SECONDS = 120
+SHELF_COLUMNS = ["confirm", "ProductName", "EstimatedQty", "BarcodeOrGTIN", "ExpiryDate", "LotNumber", "Strength", "Category", "Confidence", "SourcePhoto", "Notes"]
+
 NOISE_PATTERNS = [
     r"^\d+\s*(mg|mcg|ml|iu|g)$",
     r"^\d+\s*(δισκ|καψ|tabs|caps)",
@@ -99,36 +109,63 @@ def extract_codes(core, text: str) -> list[str]:
     return list(dict.fromkeys(results))
 
 
-def ocr_lines(core, uploaded_file) -> tuple[list[str], dict[str, Any]]:
-    debug: dict[str, Any] = {"file_hash": file_hash(uploaded_file), "ocr_available": "unknown", "errors": [], "raw_text": ""}
+def _ocr_debug(uploaded_file) -> dict[str, Any]:
+    return {
+        "file_hash": file_hash(uploaded_file),
+        "ocr_available": "unknown",
+        "errors": [],
+        "raw_text": "",
+        "ocr_cache": {"hits": 0, "misses": 0, "disk_hits": 0},
+    }
+
+
+def prepare_ocr_image(core, uploaded_file, debug: dict[str, Any]):
+    """Grayscale, upscaled and contrast-enhanced PIL image for shelf OCR, or None with the reason in debug."""
     if not uploaded_file:
-        return [], debug
+        return None
+    status = core.tesseract_status()
+    debug["ocr_available"] = status.get("available", "no")
+    if status.get("available") != "yes":
+        debug["errors"].append(status.get("reason", "tesseract unavailable"))
+        return None
+    image = core.to_img(uploaded_file)
+    if image is None:
+        debug["errors"].append("image could not be read")
+        return None
+    pil = core.ImageOps.exif_transpose(core.Image.fromarray(image)).convert("L")
+    if pil.width < 1600:
+        scale = min(3, max(2, int(1600 / max(1, pil.width))))
+        pil = pil.resize((pil.width * scale, pil.height * scale), core.Image.Resampling.LANCZOS)
+    return core.ImageEnhance.Contrast(pil).enhance(1.6)
+
+
+def ocr_pass(core, pil, psm: int, debug: dict[str, Any]) -> str:
+    return core.ocr_image_to_string(
+        pil, lang="ell+eng", psm=psm, timeout=12,
+        image_hash=debug["file_hash"], variant="shelf_contrast", cache_stats=debug["ocr_cache"],
+    )
+
+
+def _finish_ocr(texts: list[str], debug: dict[str, Any]) -> list[str]:
+    raw_text = "\n".join(texts)
+    debug["raw_text"] = raw_text
+    lines = [normalize_spaces(line) for line in raw_text.splitlines() if normalize_spaces(line)]
+    return list(dict.fromkeys(lines))
+
+
+def ocr_lines(core, uploaded_file) -> tuple[list[str], dict[str, Any]]:
+    debug = _ocr_debug(uploaded_file)
     try:
-        status = core.tesseract_status()
-        debug["ocr_available"] = status.get("available", "no")
-        if status.get("available") != "yes":
-            debug["errors"].append(status.get("reason", "tesseract unavailable"))
+        pil = prepare_ocr_image(core, uploaded_file, debug)
+        if pil is None:
             return [], debug
-        image = core.to_img(uploaded_file)
-        if image is None:
-            debug["errors"].append("image could not be read")
-            return [], debug
-        pil = core.ImageOps.exif_transpose(core.Image.fromarray(image)).convert("L")
-        if pil.width < 1600:
-            scale = min(3, max(2, int(1600 / max(1, pil.width))))
-            pil = pil.resize((pil.width * scale, pil.height * scale), core.Image.Resampling.LANCZOS)
-        pil = core.ImageEnhance.Contrast(pil).enhance(1.6)
         texts = []
-        for psm in (6, 11):
+        for psm in SHELF_OCR_PSM_MODES:
             try:
-                text = core.pytesseract.image_to_string(pil, lang="ell+eng", config=f"--psm {psm}", timeout=12)
-                texts.append(text)
+                texts.append(ocr_pass(core, pil, psm, debug))
             except Exception as exc:
                 debug["errors"].append(f"tesseract psm{psm}: {exc}")
-        raw_text = "\n".join(texts)
-        debug["raw_text"] = raw_text
-        lines = [normalize_spaces(line) for line in raw_text.splitlines() if normalize_spaces(line)]
-        return list(dict.fromkeys(lines)), debug
+        return _finish_ocr(texts, debug), debug
     except Exception as exc:
         debug["errors"].append(str(exc))
         return [], debug
@@ -176,23 +213,100 @@ def estimate_products_from_lines(core, lines: list[str], source_name: str = "")
     return rows
 
 
-def suggest_shelf_inventory(core, uploaded_files) -> tuple[pd.DataFrame, list[dict[str, Any]]]:
-    all_rows: list[dict[str, Any]] = []
-    debug_items: list[dict[str, Any]] = []
-    for index, uploaded_file in enumerate(uploaded_files or [], start=1):
-        name = getattr(uploaded_file, "name", f"photo_{index}")
-        lines, debug = ocr_lines(core, uploaded_file)
-        debug["source_photo"] = name
+def _shelf_executor() -> ThreadPoolExecutor:
+    return shared("shelf_ocr_executor", lambda: ThreadPoolExecutor(max_workers=SHELF_OCR_WORKERS, thread_name_prefix="shelf-ocr"))
+
+
+def iter_shelf_inventory(
+    core,
+    uploaded_files,
+    *,
+    workers: int = SHELF_OCR_WORKERS,
+    time_budget: float = SHELF_OCR_TIME_BUDGET_SECONDS,
+) -> Iterator[tuple[list[dict[str, Any]], dict[str, Any]]]:
+    """Draft rows and debug per photo, yielded as each photo's OCR passes finish or time_budget runs out."""
+    files = list(uploaded_files or [])
+    deadline = time.monotonic() + time_budget
+    names = [getattr(uploaded_file, "name", f"photo_{index}") for index, uploaded_file in enumerate(files, start=1)]
+    debugs = [_ocr_debug(uploaded_file) for uploaded_file in files]
+    texts: list[dict[int, str]] = [{} for _ in files]
+    waiting = [0] * len(files)
+    ocr_jobs: deque[tuple[int, Any, int]] = deque()
+    next_photo = 0
+
+    def finish(index: int) -> tuple[list[dict[str, Any]], dict[str, Any]]:
+        debug = debugs[index]
+        lines = _finish_ocr([texts[index][psm] for psm in SHELF_OCR_PSM_MODES if psm in texts[index]], debug)
+        debug["source_photo"] = names[index]
+        debug["photo_index"] = index + 1
         debug["lines"] = lines
-        debug_items.append(debug)
-        all_rows.extend(estimate_products_from_lines(core, lines, name))
-
-    if not all_rows:
-        return pd.DataFrame(columns=["confirm", "ProductName", "EstimatedQty", "BarcodeOrGTIN", "ExpiryDate", "LotNumber", "Strength", "Category", "Confidence", "SourcePhoto", "Notes"]), debug_items
+        return estimate_products_from_lines(core, lines, names[index]), debug
+
+    executor = _shelf_executor()
+    pending: dict[Any, tuple[int, int | None]] = {}
+
+    def fill() -> None:
+        nonlocal next_photo
+        while len(pending) < max(1, workers):
+            if ocr_jobs:
+                index, pil, psm = ocr_jobs.popleft()
+                pending[executor.submit(ocr_pass, core, pil, psm, debugs[index])] = (index, psm)
+            elif next_photo < len(files):
+                index, next_photo = next_photo, next_photo + 1
+                pending[executor.submit(prepare_ocr_image, core, files[index], debugs[index])] = (index, None)
+            else:
+                return
 
-    df = pd.DataFrame(all_rows)
-    cols = ["confirm", "ProductName", "EstimatedQty", "BarcodeOrGTIN", "ExpiryDate", "LotNumber", "Strength", "Category", "Confidence", "SourcePhoto", "Notes"]
-    for col in cols:
+    try:
+        fill()
+        while pending:
+            done, _ = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            finished = []
+            for future in done:
+                index, psm = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    label = f"tesseract psm{psm}: {exc}" if psm is not None else str(exc)
+                    debugs[index]["errors"].append(label)
+                    result = None
+                if psm is None and result is not None:
+                    ocr_jobs.extend((index, result, pass_psm) for pass_psm in SHELF_OCR_PSM_MODES)
+                    waiting[index] = len(SHELF_OCR_PSM_MODES)
+                    continue
+                if psm is not None:
+                    if result is not None:
+                        texts[index][psm] = result
+                    waiting[index] -= 1
+                    if waiting[index]:
+                        continue
+                finished.append(index)
+            fill()
+            for index in finished:
+                yield finish(index)
+        unfinished = sorted({index for index, _ in pending.values()} | {index for index, _, _ in ocr_jobs} | set(range(next_photo, len(files))))
+        for index in unfinished:
+            debugs[index]["errors"].append("time budget exceeded")
+            debugs[index]["timed_out"] = True
+            yield finish(index)
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def shelf_dataframe(rows: list[dict[str, Any]]) -> pd.DataFrame:
+    if not rows:
+        return pd.DataFrame(columns=SHELF_COLUMNS)
+    df = pd.DataFrame(rows)
+    for col in SHELF_COLUMNS:
         if col not in df.columns:
             df[col] = ""
-    return df[cols], debug_items
+    return df[SHELF_COLUMNS]
+
+
+def suggest_shelf_inventory(core, uploaded_files, **options) -> tuple[pd.DataFrame, list[dict[str, Any]]]:
+    results = sorted(iter_shelf_inventory(core, uploaded_files, **options), key=lambda result: result[1]["photo_index"])
+    all_rows = [row for rows, _ in results for row in rows]
+    return shelf_dataframe(all_rows), [debug for _, debug in results]
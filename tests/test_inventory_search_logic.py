@@ -9,9 +9,12 @@ class FakeWorksheet:
         self.headers = list(headers or [])
         self.records = list(records or [])
         self.appended = []
+        self.append_calls = 0
         self.read_count = 0
+        self.header_reads = 0
 
     def row_values(self, row):
+        self.header_reads += 1
         return list(self.headers)
 
     def update(self, cell, values):
@@ -33,6 +36,11 @@ class FakeWorksheet:
         self.records.append(row)
         self.appended.append(row)
 
+    def append_rows(self, values, value_input_option=None):
+        self.append_calls += 1
+        for row_values in values:
+            self.append_row(row_values, value_input_option)
+
 
 class TemporaryGoogleError(Exception):
     def __init__(self, status):
@@ -52,6 +60,20 @@ class FlakyWorksheet(FakeWorksheet):
         return list(self.records)
 
 
+class BatchWorksheet(FakeWorksheet):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batch_ranges = []
+
+    def batch_get(self, ranges):
+        self.batch_ranges.append(list(ranges))
+        sheet = [list(self.headers)] + [
+            [str(row.get(header, "")) for header in self.headers] for row in self.records
+        ]
+        start_row = int(ranges[1].split(":", 1)[0][1:])
+        return [sheet[:1], sheet[start_row - 1:]]
+
+
 def base_row(**overrides):
     row = app.make_transaction(
         code_type="Barcode",
@@ -84,6 +106,95 @@ def test_one_normal_ui_data_load_is_reused_in_cache():
     assert third.iloc[0]["Προϊόν"] == "PRODUCT"
 
 
+def test_incremental_sync_reads_only_new_tail_rows():
+    app.reset_ledger_sync()
+    ws = BatchWorksheet(headers=app.COLUMNS, records=[base_row(TransactionId="a")])
+    first, _ = app.load_data(ws)
+    ws.records.append(base_row(TransactionId="b", DeltaQty=2))
+    second, _ = app.load_data(ws)
+    assert ws.read_count == 1
+    assert ws.batch_ranges == [["1:1", "A2:AC"]]
+    assert len(first) == 1
+    assert second["TransactionId"].tolist() == ["a", "b"]
+    assert second.iloc[1]["DeltaQty"] == 2
+    assert app.google_sheets_debug()["sync_mode"] == "incremental"
+    app.load_data(ws)
+    assert ws.batch_ranges[-1] == ["1:1", "A3:AC"]
+
+
+def test_incremental_sync_falls_back_to_full_read_when_anchor_row_moves():
+    app.reset_ledger_sync()
+    ws = BatchWorksheet(headers=app.COLUMNS, records=[base_row(TransactionId="a")])
+    app.load_data(ws)
+    ws.records = [base_row(TransactionId="replaced"), base_row(TransactionId="c")]
+    data, _ = app.load_data(ws)
+    assert ws.read_count == 2
+    assert data["TransactionId"].tolist() == ["replaced", "c"]
+    assert app.google_sheets_debug()["sync_mode"] == "full"
+
+
+def test_incremental_sync_falls_back_to_full_read_when_headers_change():
+    app.reset_ledger_sync()
+    ws = BatchWorksheet(headers=app.COLUMNS, records=[base_row(TransactionId="a")])
+    app.load_data(ws)
+    ws.headers = app.COLUMNS + ["LegacyColumn"]
+    app.load_data(ws)
+    assert ws.read_count == 2
+
+
+def snapshot_worksheet(records):
+    ws = BatchWorksheet(headers=app.COLUMNS, records=records)
+    ws.spreadsheet = type("Spreadsheet", (), {"id": "sheet-1"})()
+    ws.id = 0
+    return ws
+
+
+def test_cold_start_restores_ledger_snapshot_and_reads_only_tail(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "LEDGER_SNAPSHOT_PATH", tmp_path / "ledger.sqlite3")
+    app.reset_ledger_sync()
+    records = [base_row(TransactionId="a", Ποσότητα=3), base_row(TransactionId="v", Voided=True)]
+    first, _ = app.load_data(snapshot_worksheet(records))
+
+    app.reset_ledger_sync()
+    ws = snapshot_worksheet(records + [base_row(TransactionId="b", DeltaQty=-1)])
+    restored, _ = app.load_data(ws)
+    assert ws.read_count == 0
+    assert app.google_sheets_debug()["snapshot"] == "saved"
+    assert restored["TransactionId"].tolist() == ["a", "v", "b"]
+    pd.testing.assert_frame_equal(restored.iloc[:2], first)
+
+    app.reset_ledger_sync()
+    again, _ = app.load_data(snapshot_worksheet(list(ws.records)))
+    assert again["TransactionId"].tolist() == ["a", "v", "b"]
+    assert app.google_sheets_debug()["snapshot"] == "restored"
+    assert (tmp_path / "ledger.sqlite3").stat().st_mode & 0o077 == 0
+
+
+def test_ledger_snapshot_is_off_unless_a_path_is_configured(monkeypatch):
+    monkeypatch.setattr(app, "LEDGER_SNAPSHOT_PATH", None)
+    monkeypatch.setattr(app, "_snapshot_connection", lambda: pytest.fail("snapshot written"))
+    app.reset_ledger_sync()
+    app.load_data(snapshot_worksheet([base_row(TransactionId="a")]))
+    app.reset_ledger_sync()
+    ws = snapshot_worksheet([base_row(TransactionId="a")])
+    app.load_data(ws)
+    assert ws.read_count == 1
+    app.reset_ledger_sync()
+
+
+def test_snapshot_with_changed_headers_is_replaced_by_full_read(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "LEDGER_SNAPSHOT_PATH", tmp_path / "ledger.sqlite3")
+    app.reset_ledger_sync()
+    app.load_data(snapshot_worksheet([base_row(TransactionId="a")]))
+
+    app.reset_ledger_sync()
+    ws = snapshot_worksheet([base_row(TransactionId="a")])
+    ws.headers = app.COLUMNS + ["LegacyColumn"]
+    data, _ = app.load_data(ws)
+    assert ws.read_count == 1
+    assert data["TransactionId"].tolist() == ["a"]
+
+
 def test_temporary_429_is_retried_and_then_succeeds(monkeypatch):
     monkeypatch.setattr(app.time, "sleep", lambda *_: None)
     ws = FlakyWorksheet([429], headers=app.COLUMNS, records=[base_row()])
@@ -93,6 +204,17 @@ def test_temporary_429_is_retried_and_then_succeeds(monkeypatch):
     assert app.google_sheets_debug()["last_temporary_error_type"] == "http_429"
 
 
+def test_google_debug_is_kept_per_session(monkeypatch):
+    monkeypatch.setattr(app.time, "sleep", lambda *_: None)
+    first_session, second_session = {}, {}
+    monkeypatch.setattr(app.st, "session_state", first_session)
+    app.load_data(FlakyWorksheet([429], headers=app.COLUMNS, records=[base_row()]))
+    monkeypatch.setattr(app.st, "session_state", second_session)
+    app.load_data(FlakyWorksheet([], headers=app.COLUMNS, records=[base_row()]))
+    assert first_session["google_sheets_debug"]["last_temporary_error_type"] == "http_429"
+    assert second_session["google_sheets_debug"]["last_temporary_error_type"] == ""
+
+
 def test_temporary_503_is_retried_and_then_succeeds(monkeypatch):
     monkeypatch.setattr(app.time, "sleep", lambda *_: None)
     ws = FlakyWorksheet([503], headers=app.COLUMNS, records=[base_row()])
@@ -270,6 +392,36 @@ def test_duplicate_reversal_prevention():
     assert app.reversal_exists(df, "original")
 
 
+def test_transaction_index_answers_like_column_scans():
+    rows = [
+        base_row(TransactionId="original"),
+        base_row(TransactionId="other"),
+        base_row(TransactionId="reverse-original", VoidOf="original", MovementKind=app.REVERSAL, DeltaQty=-1),
+        base_row(TransactionId="manual-void", VoidOf="other", MovementKind=app.REVERSAL, DeltaQty=-1),
+        base_row(TransactionId="kept"),
+    ]
+    df = app.records_to_dataframe(rows)
+    index = app.transaction_index(df)
+    assert index["positions"]["kept"] == 4
+    assert index["reversed_by"]["other"] == {"manual-void"}
+    for txid in ["original", "kept", "missing"]:
+        assert app.transaction_exists(df, txid, index) == app.transaction_exists(df, txid)
+        assert app.reversal_exists(df, txid, index) == app.reversal_exists(df, txid)
+    assert app.reversible_rows(df, index)["TransactionId"].tolist() == ["kept"]
+    assert app.reversible_rows(df)["TransactionId"].tolist() == ["kept"]
+
+
+def test_tail_sync_extends_transaction_index_for_idempotency():
+    app.reset_ledger_sync()
+    ws = BatchWorksheet(headers=app.COLUMNS, records=[base_row(TransactionId="a")])
+    app.load_data(ws)
+    ws.records.append(base_row(TransactionId="b"))
+    data, _ = app.load_data(ws)
+    assert app.ledger_transaction_index(ws, data)["positions"] == {"a": 0, "b": 1}
+    assert app.append_stock_transaction(ws, base_row(TransactionId="b")) == "duplicate"
+    assert ws.appended == []
+
+
 def test_negative_stock_prevention():
     ws = FakeWorksheet(headers=app.COLUMNS, records=[base_row()])
     sale = base_row(
@@ -316,6 +468,222 @@ def test_compensation_is_appended_when_race_creates_negative_stock(monkeypatch):
     )
 
 
+def test_stock_balances_match_current_stock_scan():
+    rows = [
+        base_row(TransactionId="a", DeltaQty=5),
+        base_row(TransactionId="b", DeltaQty=-2),
+        base_row(TransactionId="c", DeltaQty=4, LocationId=1),
+        base_row(TransactionId="d", DeltaQty=-3, Voided=True),
+        base_row(TransactionId="e", CodeType="QR", DeltaQty=7),
+    ]
+    df = app.records_to_dataframe(rows)
+    balances = app.stock_balances(df)
+    for code_type, location_id in [("Barcode", 0), ("Barcode", 1), ("QR", 0), ("Barcode", 2)]:
+        assert app.current_stock(df, code_type, "123", location_id, balances=balances) == app.current_stock(df, code_type, "123", location_id)
+    assert balances[("Barcode", "123", 0)] == 3
+
+
+def test_tail_sync_updates_stock_balances_and_blocks_negative_stock():
+    app.reset_ledger_sync()
+    ws = BatchWorksheet(headers=app.COLUMNS, records=[base_row(TransactionId="a", DeltaQty=2)])
+    first, _ = app.load_data(ws)
+    assert app.ledger_stock_balances(ws, first)[("Barcode", "123", 0)] == 2
+    ws.records.append(base_row(TransactionId="b", DeltaQty=-2))
+    second, _ = app.load_data(ws)
+    assert app.ledger_stock_balances(ws, second)[("Barcode", "123", 0)] == 0
+    with pytest.raises(app.InventoryError):
+        app.append_stock_transaction(ws, base_row(TransactionId="sale", DeltaQty=-1))
+    assert ws.read_count == 1
+
+
+def test_batch_append_writes_all_rows_in_one_request():
+    ws = FakeWorksheet(headers=app.COLUMNS, records=[base_row(TransactionId="existing", DeltaQty=2)])
+    rows = [
+        base_row(TransactionId="in-1", DeltaQty=3),
+        base_row(TransactionId="existing"),
+        base_row(TransactionId="out-1", DeltaQty=-4),
+        base_row(TransactionId="in-1", DeltaQty=3),
+    ]
+    statuses = app.append_stock_transactions(ws, rows)
+    assert statuses == ["saved", "duplicate", "saved", "duplicate"]
+    assert ws.append_calls == 1
+    assert [row["TransactionId"] for row in ws.appended] == ["in-1", "out-1"]
+    assert ws.read_count == 2
+
+
+def test_batch_append_rejects_whole_batch_when_any_row_goes_negative():
+    ws = FakeWorksheet(headers=app.COLUMNS, records=[base_row(TransactionId="existing", DeltaQty=1)])
+    rows = [
+        base_row(TransactionId="in-1", LocationId=1, DeltaQty=5),
+        base_row(TransactionId="out-1", DeltaQty=-2),
+    ]
+    with pytest.raises(app.InventoryError):
+        app.append_stock_transactions(ws, rows)
+    assert ws.appended == []
+    assert ws.read_count == 1
+
+
+def test_appends_reuse_validated_headers_until_the_header_row_changes():
+    app.invalidate_header_cache()
+    app.reset_ledger_sync()
+    ws = BatchWorksheet(headers=app.COLUMNS, records=[])
+    app.initialize_schema(ws)
+    assert ws.header_reads == 1
+    app.append_row(ws, base_row(TransactionId="a"))
+    app.append_row(ws, base_row(TransactionId="b"))
+    app.load_data(ws)
+    assert ws.header_reads == 1
+
+    ws.headers = app.COLUMNS + ["Extra"]
+    app.load_data(ws)
+    app.append_row(ws, base_row(TransactionId="c"))
+    assert ws.header_reads == 2
+    assert ws.appended[-1]["TransactionId"] == "c"
+    app.invalidate_header_cache()
+
+
+def test_failed_append_invalidates_header_cache():
+    app.invalidate_header_cache()
+    ws = FakeWorksheet(headers=app.COLUMNS, records=[])
+    app.initialize_schema(ws)
+
+    def broken_append_rows(values, value_input_option=None):
+        raise RuntimeError("column mismatch")
+
+    ws.append_rows = broken_append_rows
+    with pytest.raises(app.InventoryError):
+        app.append_row(ws, base_row(TransactionId="a"))
+    del ws.append_rows
+    app.append_row(ws, base_row(TransactionId="a"))
+    assert ws.header_reads == 2
+    app.invalidate_header_cache()
+
+
+def test_records_normalization_matches_per_value_helpers():
+    values = ["  depon   500 ", None, "depon 500", 12, "", "   ", "  depon   500 "]
+    flags = ["TRUE", "", None, "ναι", "false", None, 1]
+    records = [
+        {**base_row(TransactionId=f"tx-{i}"), "Προϊόν": value, "Strength": value, "Voided": flag}
+        for i, (value, flag) in enumerate(zip(values, flags))
+    ]
+    df = app.records_to_dataframe(records)
+    assert df["Προϊόν"].tolist() == [app.normalize_spaces(value).upper() for value in values]
+    assert df["Strength"].tolist() == [app.normalize_strength(value) for value in values]
+    assert df["Voided"].tolist() == [app.normalize_bool(flag) for flag in flags]
+
+
+def test_ledger_frame_uses_compact_dtypes_after_tail_sync():
+    app.reset_ledger_sync()
+    ws = BatchWorksheet(headers=app.COLUMNS, records=[base_row(TransactionId="a")])
+    app.load_data(ws)
+    ws.records.append(base_row(TransactionId="b", LocationId=2, Τοποθεσία="Πρώτος Όροφος"))
+    df, _ = app.load_data(ws)
+    for column in app.LEDGER_CATEGORY_COLUMNS:
+        assert isinstance(df[column].dtype, pd.CategoricalDtype)
+    assert df["LocationId"].dtype == "int8"
+    assert df["Voided"].dtype == bool
+    assert df["Τοποθεσία"].tolist() == [base_row()["Τοποθεσία"], "Πρώτος Όροφος"]
+    app.reset_ledger_sync()
+
+
+def test_cached_frame_is_not_changed_by_caller_mutation():
+    app.invalidate_data_cache()
+    app.reset_ledger_sync()
+    ws = FakeWorksheet(headers=app.COLUMNS, records=[base_row(TransactionId="a", DeltaQty=3)])
+    first, _ = app.load_data_cached(ws)
+    first.loc[0, "DeltaQty"] = 99
+    second, _ = app.load_data_cached(ws)
+    assert second.loc[0, "DeltaQty"] == 3
+    app.invalidate_data_cache()
+    app.reset_ledger_sync()
+
+
+def test_concurrent_cached_reads_share_one_sheet_read():
+    import threading
+    import time
+
+    class SlowWorksheet(FakeWorksheet):
+        def get_all_records(self):
+            time.sleep(0.05)
+            return super().get_all_records()
+
+    app.invalidate_data_cache()
+    app.reset_ledger_sync()
+    ws = SlowWorksheet(headers=app.COLUMNS, records=[base_row(TransactionId="a", DeltaQty=2)])
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(app.load_data_cached(ws)[0])) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert ws.read_count == 1
+    assert [len(df) for df in results] == [1] * 8
+
+    app.invalidate_data_cache(ws)
+    app.load_data_cached(ws)
+    assert ws.read_count == 2
+    app.invalidate_data_cache()
+    app.reset_ledger_sync()
+
+
+def test_script_reruns_share_locks_and_caches():
+    import importlib.util
+
+    # Streamlit executes the script in a fresh module on every rerun.
+    spec = importlib.util.spec_from_file_location("rerun_main", app.__file__)
+    rerun = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(rerun)
+    ws = FakeWorksheet(headers=app.COLUMNS)
+    assert rerun is not app
+    assert rerun._ledger_lock(ws) is app._ledger_lock(ws)
+    for name in [
+        "_GOOGLE_READ_CACHE", "_LEDGER_SYNC_STATE", "_HEADER_CACHE", "_LEDGER_LOCKS",
+        "_LEDGER_VIEW_CACHE", "_ANALYSIS_CACHE", "_OCR_CACHE",
+    ]:
+        assert getattr(rerun, name) is getattr(app, name)
+    assert rerun._barcode_executor() is app._barcode_executor()
+    assert rerun.opencv_detector("opencv_qr") is app.opencv_detector("opencv_qr")
+
+
+def test_ledger_views_are_memoized_per_ledger_version():
+    calls = []
+
+    def builder(df):
+        calls.append(len(df))
+        return app.stock_table(df)
+
+    data = app.records_to_dataframe([base_row(TransactionId="a", DeltaQty=2)])
+    first = app.cached_ledger_view(data, builder)
+    second = app.cached_ledger_view(data.copy(), builder)
+    assert calls == [1]
+    pd.testing.assert_frame_equal(first, second)
+
+    grown = app.records_to_dataframe([base_row(TransactionId="a", DeltaQty=2), base_row(TransactionId="b", DeltaQty=1)])
+    stock = app.cached_ledger_view(grown, builder)
+    assert calls == [1, 2]
+    assert int(stock["Σύνολο"].sum()) == 3
+    assert app.ledger_version(grown) == (2, "b")
+
+
+def test_ledger_views_of_different_sheets_with_the_same_shape_are_not_shared():
+    calls = []
+
+    def builder(df):
+        calls.append(df.attrs["ledger"])
+        return app.stock_table(df)
+
+    frames = {}
+    for spreadsheet_id, title, qty in [("sheet-1", "Transactions", 2), ("sheet-2", "Transactions", 5), ("sheet-1", "Archive", 7)]:
+        ws = snapshot_worksheet([base_row(TransactionId="a", DeltaQty=qty)])
+        ws.spreadsheet.id, ws.title = spreadsheet_id, title
+        app.reset_ledger_sync()
+        frames[(spreadsheet_id, title)], _ = app.load_data(ws)
+    totals = {key: int(app.cached_ledger_view(frame.copy(deep=False), builder)["Σύνολο"].sum()) for key, frame in frames.items()}
+    assert totals == {("sheet-1", "Transactions"): 2, ("sheet-2", "Transactions"): 5, ("sheet-1", "Archive"): 7}
+    assert calls == list(frames)
+    app.reset_ledger_sync()
+
+
 def test_gs1_datamatrix_parses_gtin_expiry_lot_serial():
     parsed = app.parse_gs1_datamatrix("01012345678901281726063010LOT12321SER456")
     assert parsed["gtin"] == "01234567890128"
@@ -654,6 +1022,503 @@ def test_real_generated_ean13_image_returns_requested_code():
     assert value == digits
 
 
+def test_detect_code_stops_at_first_valid_ean13_and_reports_timings(monkeypatch):
+    import numpy as np
+
+    monkeypatch.setattr(app, "datamatrix_available", lambda: False)
+
+    def fake_decode(decoder_name, variant):
+        return [("Barcode", "5206087700016", "EAN13")] if decoder_name == "opencv_barcode" else []
+
+    monkeypatch.setattr(app, "decode_barcode_variant", fake_decode)
+    detected_type, value, debug = app.detect_code(None, np.full((60, 80, 3), 255, dtype=np.uint8))
+    assert (detected_type, value) == ("EAN-13", "5206087700016")
+    assert debug["attempts"] == [
+        "pyzbar:back:0:complete:original_rgb:ok:0",
+        "opencv_barcode:back:0:complete:original_rgb:ok:1",
+    ]
+    assert "attempt_limit_reached" not in debug
+    assert set(debug["timings"]) >= {"prepare", "pyzbar", "opencv_barcode", "opencv_qr", "fallback", "total"}
+
+
+def test_detect_code_caps_attempts_and_records_decoder_errors(monkeypatch):
+    import numpy as np
+
+    monkeypatch.setattr(app, "datamatrix_available", lambda: False)
+
+    def failing_decode(decoder_name, variant):
+        raise RuntimeError("decoder down")
+
+    monkeypatch.setattr(app, "decode_barcode_variant", failing_decode)
+    _, value, debug = app.detect_code(None, np.full((60, 80, 3), 255, dtype=np.uint8))
+    assert value == ""
+    assert len(debug["attempts"]) == app.MAX_BARCODE_DECODER_ATTEMPTS
+    assert all(attempt.endswith(":failed") for attempt in debug["attempts"])
+    assert debug["attempt_limit_reached"] == app.MAX_BARCODE_DECODER_ATTEMPTS
+
+
+def test_barcode_variants_are_built_lazily_cheapest_tier_first(monkeypatch):
+    import numpy as np
+
+    resized = []
+    real_resize = app.cv2.resize
+    monkeypatch.setattr(app.cv2, "resize", lambda *args, **kwargs: resized.append(1) or real_resize(*args, **kwargs))
+    variants = app.barcode_variants(np.zeros((20, 30, 3), dtype=np.uint8))
+    assert [next(variants)[0], next(variants)[0]] == ["original_rgb", "grayscale"]
+    assert resized == []
+
+    debug = {"rotations_attempted": [], "crops_attempted": [], "variants_attempted": []}
+    names = [job[3] for job in app._barcode_attempts(np.zeros((20, 30, 3), dtype=np.uint8), "back", debug)][:126]
+    first_enhanced = names.index("increased_contrast")
+    first_upscale = names.index("upscale_2x")
+    assert set(names[:first_enhanced]) == {"original_rgb", "grayscale"}
+    assert "original_rgb" not in names[first_enhanced:first_upscale]
+
+
+def test_barcode_regions_localize_code_on_large_photo():
+    import numpy as np
+
+    bits = _ean13_pattern("5206087700016")
+    canvas = np.full((1500, 2000, 3), 235, dtype=np.uint8)
+    x0, y0, module = 900, 1000, 4
+    for i, bit in enumerate(bits):
+        if bit == "1":
+            canvas[y0:y0 + 250, x0 + i * module:x0 + (i + 1) * module] = 0
+    regions = app.barcode_regions(canvas)
+    assert regions
+    rx0, ry0, rx1, ry1 = regions[0]
+    assert rx0 <= x0 and ry0 <= y0
+    assert rx1 >= x0 + len(bits) * module and ry1 >= y0 + 250
+    assert (rx1 - rx0) * (ry1 - ry0) < canvas.shape[0] * canvas.shape[1] / 4
+    assert next(app.barcode_crops(canvas))[0] == "region_1"
+
+
+def test_large_photo_is_scanned_downscaled_first_without_upscales(monkeypatch):
+    import numpy as np
+
+    monkeypatch.setattr(app, "datamatrix_available", lambda: False)
+
+    seen = []
+
+    def fake_decode(decoder_name, variant):
+        seen.append(max(variant.shape[:2]))
+        return []
+
+    monkeypatch.setattr(app, "decode_barcode_variant", fake_decode)
+    _, _, debug = app.detect_code(None, np.full((1500, 2400, 3), 255, dtype=np.uint8))
+    assert max(seen) <= 2400
+    assert seen[0] <= app.BARCODE_PYRAMID_MAX_SIDE
+    # Only the quick stage runs downscaled; the full-resolution stages get the rest of the budget.
+    assert debug["pyramid_attempts"] == {"downscaled": 3, "full": app.MAX_BARCODE_DECODER_ATTEMPTS - 3}
+    assert debug["attempts"][:3] == [f"{name}:back@downscaled:0:complete:original_rgb:ok:0" for name in app.BARCODE_DECODERS]
+    assert not any("upscale" in variant for variant in debug["variants_attempted"] if "@" not in variant)
+    assert not any(attempt.startswith("opencv_qr:") and "_half:" in attempt for attempt in debug["attempts"])
+
+
+def test_full_resolution_regions_are_decoded_before_the_variant_sweep(monkeypatch):
+    import numpy as np
+
+    monkeypatch.setattr(app, "datamatrix_available", lambda: False)
+    monkeypatch.setattr(app, "decode_barcode_variant", lambda decoder_name, variant: [])
+    monkeypatch.setattr(app, "barcode_regions", lambda gray, **kwargs: [(10, 10, 200, 120)])
+    _, _, debug = app.detect_code(None, np.full((1500, 2400, 3), 255, dtype=np.uint8))
+    full = [attempt.split(":")[1:5] for attempt in debug["attempts"] if attempt.split(":")[1] == "back"]
+    regions_stage = full[:2 * 2 * 3]
+    assert {(rotation, crop) for _, rotation, crop, _ in regions_stage} == {("0", "region_1"), ("90", "region_1")}
+    assert {variant for *_, variant in regions_stage} == {"original_rgb", "grayscale"}
+    assert full[len(regions_stage)][2] == "complete"
+    assert ["back", "0", "region_1", "original_rgb"] not in full[len(regions_stage):]
+
+
+def test_small_photo_reports_full_pyramid_level(monkeypatch):
+    import numpy as np
+
+    monkeypatch.setattr(app, "decode_barcode_variant", lambda decoder_name, variant: [("Barcode", "5206087700016", "EAN13")])
+    _, value, debug = app.detect_code(None, np.full((60, 80, 3), 255, dtype=np.uint8))
+    assert value == "5206087700016"
+    assert debug["pyramid_level"] == "full"
+    assert debug["pyramid_attempts"] == {"full": 1}
+
+
+def test_analysis_cache_is_shared_bounded_and_returns_private_copies(monkeypatch):
+    app.clear_analysis_cache()
+    monkeypatch.setattr(app, "ANALYSIS_CACHE_SIZE", 2)
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        return {"value": value, "debug": {"attempts": []}}
+
+    first = app.cached_analysis("detect_code", "hash-a", lambda: compute("a"))
+    first["debug"]["attempts"].append("mutated")
+    again = app.cached_analysis("detect_code", "hash-a", lambda: compute("a"))
+    assert calls == ["a"]
+    assert again["debug"]["attempts"] == []
+
+    app.cached_analysis("back_photo", "hash-a", lambda: compute("b"))
+    app.cached_analysis("detect_code", "hash-c", lambda: compute("c"))
+    app.cached_analysis("detect_code", "hash-a", lambda: compute("a"))
+    assert calls == ["a", "b", "c", "a"]
+    assert app.analysis_cache_stats()["entries"] == 2
+    app.clear_analysis_cache()
+
+
+@pytest.mark.parametrize("debug", [
+    {"timed_out": True, "errors": []},
+    {"ocr": {"available": "no", "reason": "tesseract executable was not found in PATH"}, "errors": []},
+])
+def test_analysis_cache_does_not_store_incomplete_results(monkeypatch, tmp_path, debug):
+    app.clear_analysis_cache()
+    monkeypatch.setattr(app, "ANALYSIS_CACHE_PATH", tmp_path / "analysis.sqlite3")
+    calls = []
+    compute = lambda: calls.append(1) or ({"expiry_date": ""}, [], dict(debug))
+    app.cached_analysis("back_expiry_ocr", "hash-a", compute)
+    app.cached_analysis("back_expiry_ocr", "hash-a", compute)
+    app.cached_analysis("back_photo", "hash-a", lambda: calls.append(1) or {"type": "Barcode", "expiry_debug": dict(debug)})
+    app.cached_analysis("back_photo", "hash-a", lambda: calls.append(1) or {"type": "Barcode", "expiry_debug": dict(debug)})
+    assert len(calls) == 4
+    assert app.analysis_cache_stats()["entries"] == 0
+
+    skipped = {"ocr": {"available": "no"}, "errors": [], "skipped": "expiry_from_machine_readable_code"}
+    app.cached_analysis("back_photo", "hash-b", lambda: {"type": "DataMatrix", "expiry_debug": skipped})
+    decoder_errors = {"errors": ["pyzbar back:0:complete:original_rgb: pyzbar unavailable"], "timed_out": False}
+    app.cached_analysis("detect_code", "hash-b", lambda: ("EAN-13", "5206087700016", decoder_errors))
+    assert app.analysis_cache_stats()["entries"] == 2
+    app.clear_analysis_cache()
+
+
+def test_analysis_cache_survives_restart_when_disk_path_is_set(monkeypatch, tmp_path):
+    app.clear_analysis_cache()
+    monkeypatch.setattr(app, "ANALYSIS_CACHE_PATH", tmp_path / "analysis.sqlite3")
+    assert app.cached_analysis("detect_code", "hash-a", lambda: ("EAN-13", "5206087700016", {})) == ("EAN-13", "5206087700016", {})
+    app.clear_analysis_cache()
+    detected_type, value, _ = app.cached_analysis("detect_code", "hash-a", lambda: pytest.fail("recomputed"))
+    assert (detected_type, value) == ("EAN-13", "5206087700016")
+    assert app.analysis_cache_stats()["disk_hits"] == 1
+    app.clear_analysis_cache()
+
+
+def test_opencv_detectors_are_reused_per_thread():
+    import threading
+
+    assert app.opencv_detector("opencv_barcode") is app.opencv_detector("opencv_barcode")
+    assert app.opencv_detector("opencv_qr") is app.opencv_detector("opencv_qr")
+    other = []
+    thread = threading.Thread(target=lambda: other.append(app.opencv_detector("opencv_qr")))
+    thread.start()
+    thread.join()
+    assert other[0] is not app.opencv_detector("opencv_qr")
+
+
+class FakeTessBaseAPI:
+    created = 0
+
+    def __init__(self, lang):
+        if lang == "missing":
+            raise RuntimeError("Failed to init API, possibly an invalid tessdata path")
+        FakeTessBaseAPI.created += 1
+        self.lang = lang
+        self.psm = None
+        self.variables = {}
+        self.recognize_ok = True
+
+    def SetPageSegMode(self, psm):
+        self.psm = psm
+
+    def SetVariable(self, name, value):
+        self.variables[name] = value
+
+    def SetImage(self, image):
+        self.image = image
+
+    def Recognize(self, timeout=0):
+        self.timeout = timeout
+        return self.recognize_ok
+
+    def GetUTF8Text(self):
+        return f"{self.lang} psm{self.psm} {self.variables.get('tessedit_char_whitelist', '')}".strip()
+
+    def Clear(self):
+        pass
+
+
+@pytest.fixture
+def fake_tesserocr(monkeypatch):
+    import types
+
+    FakeTessBaseAPI.created = 0
+    monkeypatch.setattr(app, "tesserocr", types.SimpleNamespace(PyTessBaseAPI=FakeTessBaseAPI, tesseract_version=lambda: "tesseract 5.3.0\n leptonica"))
+    monkeypatch.setattr(app, "_TESSEROCR_POOLS", {})
+    return FakeTessBaseAPI
+
+
+def test_ocr_engine_reuses_one_pooled_handle_per_language_across_psm_and_threads(fake_tesserocr):
+    import threading
+    import numpy as np
+
+    image = np.full((20, 20), 255, dtype=np.uint8)
+    assert app.ocr_image_to_string(image, lang="eng", psm=6, whitelist="0123") == "eng psm6 0123"
+    assert app.ocr_image_to_string(image, lang="eng", psm=7) == "eng psm7"
+    assert app.ocr_image_to_string(image, lang="eng", psm=11) == "eng psm11"
+    assert app.ocr_image_to_string(image, lang="ell+eng", psm=6) == "ell+eng psm6"
+    assert fake_tesserocr.created == 2
+    thread = threading.Thread(target=lambda: app.ocr_image_to_string(image, lang="eng", psm=6))
+    thread.start()
+    thread.join()
+    assert fake_tesserocr.created == 2
+    assert app.tesseract_status() == {"available": "yes", "engine": "tesserocr", "version": "tesseract 5.3.0"}
+
+    with app.tesserocr_api("eng", wait=1) as api:
+        api.recognize_ok = False
+    with pytest.raises(RuntimeError, match="timeout"):
+        app.ocr_image_to_string(image, lang="eng", psm=6, timeout=2)
+
+
+def test_tesserocr_pool_is_bounded_per_language(fake_tesserocr, monkeypatch):
+    import threading
+
+    monkeypatch.setattr(app, "TESSEROCR_POOL_SIZE", 1)
+    handles = []
+
+    def second_caller():
+        with app.tesserocr_api("eng", wait=30) as api:
+            handles.append(api)
+
+    # The second caller has to wait for the only handle instead of creating another.
+    with app.tesserocr_api("eng", wait=30) as first:
+        thread = threading.Thread(target=second_caller)
+        thread.start()
+    thread.join()
+    assert handles == [first]
+    assert fake_tesserocr.created == 1
+
+
+def test_ocr_falls_back_to_pytesseract_when_no_handle_frees_up(fake_tesserocr, monkeypatch):
+    import types
+    import numpy as np
+
+    monkeypatch.setattr(app, "TESSEROCR_POOL_SIZE", 1)
+    monkeypatch.setattr(app, "pytesseract", types.SimpleNamespace(image_to_string=lambda image, **kwargs: "subprocess"))
+    with app.tesserocr_api("eng", wait=0) as stuck:
+        assert stuck is not None
+        assert app.ocr_image_to_string(np.zeros((4, 4), dtype=np.uint8), lang="eng", psm=6, timeout=0) == "subprocess"
+    assert fake_tesserocr.created == 1
+
+
+def test_tesserocr_init_failure_is_an_engine_error_not_a_timeout(fake_tesserocr):
+    import numpy as np
+
+    with pytest.raises(app.OcrEngineError):
+        app.ocr_image_to_string(np.zeros((4, 4), dtype=np.uint8), lang="missing", psm=6)
+    assert not issubclass(app.OcrEngineError, RuntimeError)
+    assert app._TESSEROCR_POOLS["missing"]["created"] == 0
+
+
+def test_expiry_ocr_stops_on_engine_error_without_reporting_a_timeout(monkeypatch):
+    import numpy as np
+
+    calls = []
+
+    def broken_engine(image, **kwargs):
+        calls.append(kwargs["variant"])
+        raise app.OcrEngineError("tesserocr could not load eng")
+
+    monkeypatch.setattr(app, "tesseract_status", lambda: {"available": "yes", "engine": "tesserocr"})
+    monkeypatch.setattr(app, "ocr_image_to_string", broken_engine)
+    _, _, debug = app.detect_back_expiry_ocr(np.full((120, 160, 3), 255, dtype=np.uint8), "hash")
+    assert len(calls) == 1
+    assert debug["attempts"][-1].endswith(":engine_failed")
+    assert not debug["timed_out"]
+    assert debug["ocr"]["available"] == "no"
+    assert app.analysis_incomplete(({}, [], debug))
+
+
+def test_ocr_engine_falls_back_to_pytesseract(monkeypatch):
+    import types
+    import numpy as np
+
+    calls = []
+    monkeypatch.setattr(app, "tesserocr", None)
+    monkeypatch.setattr(app, "pytesseract", types.SimpleNamespace(image_to_string=lambda image, **kwargs: calls.append(kwargs) or "text"))
+    assert app.ocr_image_to_string(np.zeros((4, 4), dtype=np.uint8), lang="eng", psm=6, whitelist="0123", timeout=3) == "text"
+    assert calls == [{"lang": "eng", "config": "--psm 6 -c tessedit_char_whitelist=0123", "timeout": 3}]
+
+
+def test_gs1_datamatrix_short_circuits_scan_and_expiry_ocr(monkeypatch):
+    import numpy as np
+
+    payload = "0105206087700016172712311012345A\x1d21SER999"
+    monkeypatch.setattr(app, "datamatrix_available", lambda: True)
+    monkeypatch.setattr(app, "datamatrix_fast", lambda: True)
+    monkeypatch.setattr(app, "decode_datamatrix", lambda image: [payload])
+    monkeypatch.setattr(app, "decode_barcode_variant", lambda decoder_name, variant: pytest.fail("grid should be skipped"))
+    monkeypatch.setattr(app, "detect_back_expiry_ocr", lambda *args: pytest.fail("expiry OCR should be skipped"))
+    result = app.analyze_back_photo(np.full((60, 80, 3), 255, dtype=np.uint8), "hash")
+    assert result["type"] == "DataMatrix"
+    assert result["gtin"] == "05206087700016"
+    assert result["expiry"] == "2027-12-31"
+    assert result["parsed"]["lot_number"] == "12345A"
+    assert result["barcode_debug"]["attempts"] == ["datamatrix:back:ok:1"]
+    assert result["expiry_debug"]["skipped"] == "expiry_from_machine_readable_code"
+
+
+def test_slow_datamatrix_backend_runs_once_and_only_without_a_certain_read(monkeypatch):
+    import numpy as np
+
+    seen = []
+    monkeypatch.setattr(app, "datamatrix_available", lambda: True)
+    monkeypatch.setattr(app, "datamatrix_fast", lambda: False)
+    monkeypatch.setattr(app, "decode_datamatrix", lambda image: seen.append(image.shape) or [])
+    photo = np.full((1500, 2000, 3), 255, dtype=np.uint8)
+
+    monkeypatch.setattr(app, "decode_barcode_variant", lambda decoder_name, variant: [("Barcode", "5206087700016", "pyzbar")] if decoder_name == "pyzbar" else [])
+    _, value, debug = app.detect_code(None, photo)
+    assert value == "5206087700016"
+    assert seen == []
+    assert not any(attempt.startswith("datamatrix") for attempt in debug["attempts"])
+
+    monkeypatch.setattr(app, "decode_barcode_variant", lambda decoder_name, variant: [])
+    _, value, debug = app.detect_code(None, photo)
+    assert value == ""
+    assert seen == [(750, 1000, 3)]
+    assert debug["attempts"][-1] == "datamatrix:back@downscaled:ok:0"
+
+
+def test_fast_datamatrix_backend_reaches_full_resolution_only_without_a_certain_read(monkeypatch):
+    import numpy as np
+
+    seen = []
+    monkeypatch.setattr(app, "datamatrix_available", lambda: True)
+    monkeypatch.setattr(app, "datamatrix_fast", lambda: True)
+    monkeypatch.setattr(app, "decode_datamatrix", lambda image: seen.append(image.shape) or [])
+    photo = np.full((1500, 2000, 3), 255, dtype=np.uint8)
+
+    monkeypatch.setattr(app, "decode_barcode_variant", lambda decoder_name, variant: [("Barcode", "5206087700016", "pyzbar")] if decoder_name == "pyzbar" else [])
+    app.detect_code(None, photo)
+    assert seen == [(750, 1000, 3)]
+
+    seen.clear()
+    monkeypatch.setattr(app, "decode_barcode_variant", lambda decoder_name, variant: [])
+    _, _, debug = app.detect_code(None, photo)
+    assert seen == [(750, 1000, 3), (1500, 2000, 3)]
+    assert debug["attempts"][0] == "datamatrix:back@downscaled:ok:0"
+    escalation = debug["attempts"].index("datamatrix:back:ok:0")
+    assert "@downscaled" in debug["attempts"][escalation - 1]
+    assert debug["attempts"][escalation + 1].startswith("pyzbar:back:")
+
+
+def test_real_datamatrix_is_decoded_with_optional_backend():
+    import numpy as np
+
+    zxingcpp = pytest.importorskip("zxingcpp")
+    payload = "0105206087700016172712311012345A\x1d21SER999"
+    image = np.array(zxingcpp.create_barcode(payload, zxingcpp.BarcodeFormat.DataMatrix).to_image(scale=6))
+    detected_type, value, debug = app.detect_code(None, np.stack([image] * 3, axis=-1))
+    assert detected_type == "DataMatrix"
+    assert debug["selected"]["gtin"] == "05206087700016"
+    assert app.parse_machine_readable_fields(value)["serial_number"] == "SER999"
+
+
+def test_ean13_bar_fallback_votes_across_noisy_scanlines():
+    import numpy as np
+
+    digits = "5206087700016"
+    bits = _ean13_pattern(digits)
+    module = 3
+    image = np.full((120, (len(bits) + 40) * module), 255, dtype=np.uint8)
+    for i, bit in enumerate(bits):
+        if bit == "1":
+            image[10:100, (20 + i) * module:(21 + i) * module] = 0
+    speckles = np.random.default_rng(0).random(image.shape) < 0.05
+    image[speckles] = 255 - image[speckles]
+    rgb = np.stack([image] * 3, axis=-1)
+    assert app.decode_ean13_bars_fallback(rgb) == digits
+    assert app.decode_ean13_bars_fallback(rgb[:, ::-1]) == digits
+    assert app.decode_ean13_bars_fallback(np.full((50, 50, 3), 255, dtype=np.uint8)) == ""
+
+
+def test_ean13_bar_fallback_reads_nothing_from_noise_or_text():
+    import numpy as np
+
+    for seed in range(10):
+        rng = np.random.default_rng(seed)
+        noise = rng.integers(0, 256, (750, 1000, 3), dtype=np.uint8)
+        text = np.full((750, 1000, 3), 235, dtype=np.uint8)
+        for line in range(8):
+            words = "".join(chr(c) for c in rng.integers(65, 91, 18))
+            app.cv2.putText(text, words, (30, 80 + line * 80), app.cv2.FONT_HERSHEY_SIMPLEX, 1.5, (20, 20, 20), 3)
+        assert app.decode_ean13_bars_fallback(noise) == ""
+        assert app.decode_ean13_bars_fallback(app.cv2.GaussianBlur(noise, (5, 5), 0)) == ""
+        assert app.decode_ean13_bars_fallback(text) == ""
+
+
+def test_early_exit_policy_reasons():
+    ean = app.classify_barcode_value("Barcode", "5206087700016")
+    gtin14 = app.classify_barcode_value("Barcode", "05206087700016")
+    qr = app.classify_barcode_value("QR", "(01)05206087700016(17)271231")
+    other = app.classify_barcode_value("Barcode", "4006381333931")
+    code128 = app.classify_barcode_value("Barcode", "ABC-123")
+    assert app.early_exit_reason([ean]) == "unambiguous_ean13"
+    assert app.early_exit_reason([qr]) == "gs1_valid_gtin"
+    assert app.early_exit_reason([gtin14]) == ""
+    assert app.early_exit_reason([gtin14, gtin14]) == "agreeing_attempts"
+    assert app.early_exit_reason([ean, other]) == ""
+    assert app.early_exit_reason([code128, code128, code128]) == ""
+    assert app.early_exit_reason([qr], {"gs1_valid_gtin": False}) == ""
+    assert app.early_exit_reason([qr, ean], {"unambiguous_ean13": False, "gs1_valid_gtin": False}) == "agreeing_attempts"
+    assert not app.choose_detected_code([ean, qr, ean])["ambiguous"]
+
+
+def test_early_exit_waits_while_a_url_qr_disagrees_with_an_ean13():
+    ean = app.classify_barcode_value("Barcode", "5206087700016")
+    url = app.classify_barcode_value("QR", "https://example.com/p/1")
+    assert app.choose_detected_code([url, ean])["ambiguous"]
+    assert app.early_exit_reason([url, ean]) == ""
+    assert app.early_exit_reason([ean, url, ean]) == ""
+
+
+def test_detect_code_stops_on_configured_agreement(monkeypatch):
+    import numpy as np
+
+    monkeypatch.setattr(app, "datamatrix_available", lambda: False)
+    monkeypatch.setattr(app, "decode_barcode_variant", lambda decoder_name, variant: [("QR", "(01)05206087700016(17)271231", "QRCODE")] if decoder_name == "opencv_qr" else [])
+    image = np.full((60, 80, 3), 255, dtype=np.uint8)
+    _, _, debug = app.detect_code(None, image)
+    assert debug["early_exit"] == "gs1_valid_gtin"
+    assert len(debug["attempts"]) == 3
+    detected_type, _, debug = app.detect_code(None, image, early_exit={"gs1_valid_gtin": False, "agreeing_attempts": 3})
+    assert detected_type == "QR"
+    assert debug["early_exit"] == "agreeing_attempts"
+    # opencv_qr skips the half crops, so the third read comes from the central region.
+    assert debug["attempts"][-1] == "opencv_qr:back:0:central_region:original_rgb:ok:1"
+
+
+def test_barcode_corpus_regression():
+    from benchmarks import barcode_corpus
+
+    samples = [
+        sample
+        for sample in barcode_corpus.synthetic_corpus()
+        if sample["kind"] in {"EAN-13", "EAN-8", "QR"} and sample["name"].endswith((":clean", ":rotated_12", ":low_contrast"))
+    ]
+    report = barcode_corpus.run_benchmark(samples)
+    misses = [result["name"] for result in report["results"] if not result["decoded"]]
+    assert misses == []
+    assert report["median_attempts"] <= 6
+
+
+def test_small_barcode_on_12mp_photo_is_decoded_from_a_localized_region():
+    from benchmarks import barcode_corpus
+
+    # A 238 px wide EAN-13 on a 4000x3000 photo: about 6% of the long side.
+    photo = barcode_corpus.on_photo(barcode_corpus.render_bars(barcode_corpus.ean13_bits("5206087700016")))
+    gray = app.cv2.cvtColor(photo, app.cv2.COLOR_RGB2GRAY)
+    assert len(app.barcode_regions(gray)) >= 1
+    _, value, debug = app.detect_code(None, photo)
+    assert value == "5206087700016"
+    assert debug["selected"]["crop"].startswith("region_")
+
+
 def test_invalid_checksum_candidate_is_rejected():
     selected = app.choose_detected_code([app.classify_barcode_value("Barcode", "5206087700017")])
     assert not selected.get("valid")
@@ -813,3 +1678,208 @@ def test_timeout_does_not_crash_app(monkeypatch):
     found, debug = app._lookup_greek_provider("pharmacy295.gr", "https://www.pharmacy295.gr/search?s=5201234567890", "5201234567890")
     assert found == []
     assert "connection" in debug["error"]
+
+
+def _fake_shelf_core(block=lambda name, psm: None, events=None):
+    import types
+
+    def ocr_image_to_string(pil, *, lang, psm, timeout, **cache):
+        name = pil.info["name"]
+        if events is not None:
+            events.append(f"ocr:{name}:{psm}")
+        block(name, psm)
+        return f"BRIVIACT {name.upper()} 100MG\n" if psm == 6 else ""
+
+    return types.SimpleNamespace(ocr_image_to_string=ocr_image_to_string, is_valid_gtin_check_digit=app.is_valid_gtin_check_digit)
+
+
+class FakeUpload:
+    def __init__(self, name):
+        self.name = name
+
+    def getvalue(self):
+        return self.name.encode()
+
+
+def test_shelf_inventory_runs_photos_concurrently_in_upload_order(monkeypatch):
+    import threading
+    import shelf_photo
+
+    # Both psm-6 passes must be running at the same time to get past the barrier.
+    barrier = threading.Barrier(2, timeout=10)
+    core = _fake_shelf_core(block=lambda name, psm: barrier.wait() if psm == 6 and name in {"alpha", "beta"} else None)
+    monkeypatch.setattr(shelf_photo, "prepare_ocr_image", lambda core, upload, debug: _named_pil(upload.name))
+    uploads = [FakeUpload(name) for name in ["alpha", "beta", "gamma", "delta"]]
+    draft, debug = shelf_photo.suggest_shelf_inventory(core, uploads, workers=4)
+    assert [item["source_photo"] for item in debug] == ["alpha", "beta", "gamma", "delta"]
+    assert list(draft["ProductName"]) == ["BRIVIACT ALPHA 100MG", "BRIVIACT BETA 100MG", "BRIVIACT GAMMA 100MG", "BRIVIACT DELTA 100MG"]
+    assert not any(item["errors"] for item in debug)
+
+
+def test_shelf_inventory_runs_a_photos_ocr_before_preparing_the_next(monkeypatch):
+    import shelf_photo
+
+    events = []
+    core = _fake_shelf_core(events=events)
+    monkeypatch.setattr(shelf_photo, "prepare_ocr_image", lambda core, upload, debug: events.append(f"prepare:{upload.name}") or _named_pil(upload.name))
+    results = list(shelf_photo.iter_shelf_inventory(core, [FakeUpload("alpha"), FakeUpload("beta")], workers=1))
+    assert [debug["source_photo"] for _, debug in results] == ["alpha", "beta"]
+    assert events == ["prepare:alpha", "ocr:alpha:6", "ocr:alpha:11", "prepare:beta", "ocr:beta:6", "ocr:beta:11"]
+    assert shelf_photo._shelf_executor() is shelf_photo._shelf_executor()
+
+
+def test_shelf_inventory_time_budget_yields_partial_results(monkeypatch):
+    import threading
+    import shelf_photo
+
+    release = threading.Event()
+    core = _fake_shelf_core(block=lambda name, psm: release.wait(10) if name == "slow" else None)
+    monkeypatch.setattr(shelf_photo, "prepare_ocr_image", lambda core, upload, debug: _named_pil(upload.name))
+    try:
+        results = list(shelf_photo.iter_shelf_inventory(core, [FakeUpload("slow"), FakeUpload("fast")], workers=4, time_budget=0.5))
+    finally:
+        release.set()
+    assert [debug["source_photo"] for _, debug in results] == ["fast", "slow"]
+    assert results[0][0][0]["ProductName"] == "BRIVIACT FAST 100MG"
+    assert results[1][0] == []
+    assert "time budget exceeded" in results[1][1]["errors"]
+
+
+def _named_pil(name):
+    pil = app.Image.new("L", (8, 8), 255)
+    pil.info["name"] = name
+    return pil
+
+
+def _synthetic_back_label():
+    import numpy as np
+
+    image = np.full((1500, 2000, 3), 235, dtype=np.uint8)
+    app.cv2.putText(image, "LOT A12345", (300, 900), app.cv2.FONT_HERSHEY_SIMPLEX, 2, (20, 20, 20), 5)
+    app.cv2.putText(image, "EXP 12/2027", (300, 1050), app.cv2.FONT_HERSHEY_SIMPLEX, 2, (20, 20, 20), 5)
+    return image
+
+
+def test_expiry_text_regions_find_printed_lines():
+    gray = app.cv2.cvtColor(_synthetic_back_label(), app.cv2.COLOR_RGB2GRAY)
+    boxes = app.expiry_text_regions(gray)
+    assert 2 <= len(boxes) <= app.MAX_EXPIRY_REGION_OCR_CALLS
+    assert any(x0 <= 300 and y0 <= 1000 and x1 >= 650 and y1 >= 1050 and y1 - y0 < 200 for x0, y0, x1, y1 in boxes)
+
+
+def test_back_expiry_ocr_reads_regions_before_full_image(monkeypatch):
+    calls = []
+
+    def fake_ocr(image, *, lang, psm, whitelist="", timeout=8, **cache):
+        calls.append((psm, image.shape))
+        return "EXP 12/2027" if psm == 7 and len(calls) == 2 else "LOT A12345"
+
+    monkeypatch.setattr(app, "tesseract_status", lambda: {"available": "yes"})
+    monkeypatch.setattr(app, "ocr_image_to_string", fake_ocr)
+    fields, _, debug = app.detect_back_expiry_ocr(_synthetic_back_label(), "hash")
+    assert fields["expiry_date"]
+    assert debug["variant_used"] == "back_expiry_region_2_2x_psm7"
+    assert [psm for psm, _ in calls] == [7, 7]
+    assert all(shape[0] * shape[1] < 1500 * 2000 for _, shape in calls)
+
+
+def test_ocr_results_are_memoized_per_hash_variant_psm_and_lang(monkeypatch, tmp_path):
+    import numpy as np
+
+    calls = []
+    monkeypatch.setattr(app, "tesserocr", None)
+    monkeypatch.setattr(app, "pytesseract", type("FakeTesseract", (), {"image_to_string": staticmethod(lambda image, **kwargs: calls.append(kwargs) or "EXP 12/2027")}))
+    app.clear_ocr_cache()
+    image = np.zeros((4, 4), dtype=np.uint8)
+    stats = {"hits": 0, "misses": 0, "disk_hits": 0}
+    for _ in range(2):
+        app.ocr_image_to_string(image, lang="eng", psm=6, image_hash="h1", variant="gray_2x", cache_stats=stats)
+    app.ocr_image_to_string(image, lang="eng", psm=11, image_hash="h1", variant="gray_2x", cache_stats=stats)
+    app.ocr_image_to_string(image, lang="ell+eng", psm=6, image_hash="h1", variant="gray_2x", cache_stats=stats)
+    app.ocr_image_to_string(image, lang="eng", psm=6, image_hash="h1", variant="clahe_2x", cache_stats=stats)
+    app.ocr_image_to_string(image, lang="eng", psm=6)
+    app.ocr_image_to_string(image, lang="eng", psm=6)
+    assert len(calls) == 6
+    assert stats == {"hits": 1, "misses": 4, "disk_hits": 0}
+
+    monkeypatch.setattr(app, "ANALYSIS_CACHE_PATH", tmp_path / "analysis.sqlite")
+    app.ocr_image_to_string(image, lang="eng", psm=7, image_hash="h2", variant="region_1")
+    app.clear_ocr_cache()
+    assert app.ocr_image_to_string(image, lang="eng", psm=7, image_hash="h2", variant="region_1") == "EXP 12/2027"
+    assert len(calls) == 7
+    assert app.ocr_cache_stats()["disk_hits"] == 1
+    app.clear_ocr_cache()
+
+
+def test_back_expiry_ocr_reports_cache_hits_on_rerun(monkeypatch):
+    monkeypatch.setattr(app, "tesseract_status", lambda: {"available": "yes"})
+    monkeypatch.setattr(app, "tesserocr", None)
+    monkeypatch.setattr(app, "pytesseract", type("FakeTesseract", (), {"image_to_string": staticmethod(lambda image, **kwargs: "")}))
+    app.clear_ocr_cache()
+    image = _synthetic_back_label()
+    _, _, first = app.detect_back_expiry_ocr(image, "label-hash")
+    _, _, second = app.detect_back_expiry_ocr(image, "label-hash")
+    assert first["ocr_cache"]["misses"] == len(first["attempts"]) > 0
+    assert second["ocr_cache"] == {"hits": len(first["attempts"]), "misses": 0, "disk_hits": 0}
+    app.clear_ocr_cache()
+
+
+def test_back_photo_stages_share_one_preprocessing_context(monkeypatch):
+    import numpy as np
+
+    monkeypatch.setattr(app, "datamatrix_available", lambda: False)
+    monkeypatch.setattr(app, "decode_barcode_variant", lambda decoder_name, variant: [])
+    monkeypatch.setattr(app, "decode_ean13_bars_fallback", lambda image: "")
+    monkeypatch.setattr(app, "tesseract_status", lambda: {"available": "yes"})
+    monkeypatch.setattr(app, "ocr_image_to_string", lambda image, **kwargs: "")
+    conversions = []
+    grayscale = app._grayscale
+    monkeypatch.setattr(app, "_grayscale", lambda image: conversions.append(image.shape) or grayscale(image))
+    back = np.full((120, 160, 3), 255, dtype=np.uint8)
+    result = app.analyze_back_photo(back, "")
+    assert conversions == [(120, 160, 3)]
+    assert result["expiry_debug"]["preprocessing"]["reused"] >= 2
+
+    context = app.image_context(back)
+    assert app.derived_buffer(context, ("expiry_contrast", "2x"), lambda: "first") == "first"
+    assert app.derived_buffer(context, ("expiry_contrast", "2x"), lambda: pytest.fail("recomputed")) == "first"
+    assert app.derived_buffer(None, ("gray",), lambda: "uncached") == "uncached"
+
+
+def test_back_expiry_ocr_miss_is_capped_in_calls_and_time(monkeypatch):
+    import numpy as np
+
+    calls = []
+    monkeypatch.setattr(app, "tesseract_status", lambda: {"available": "yes"})
+    monkeypatch.setattr(app, "ocr_image_to_string", lambda image, **kwargs: calls.append((kwargs["variant"], kwargs["psm"])) or "")
+    monkeypatch.setattr(app, "expiry_text_regions", lambda gray: [(0, 0, 40, 20)] * 4)
+    _, _, debug = app.detect_back_expiry_ocr(np.full((60, 80, 3), 255, dtype=np.uint8), "")
+    assert len(calls) == app.MAX_BACK_EXPIRY_TOTAL_OCR_CALLS
+    assert calls[4:] == [("back_expiry_gray_2x", 6), ("back_expiry_sparse_2x", 11)]
+
+    calls.clear()
+    monkeypatch.setattr(app, "BACK_EXPIRY_OCR_DEADLINE_SECONDS", 0)
+    _, _, debug = app.detect_back_expiry_ocr(np.full((60, 80, 3), 255, dtype=np.uint8), "")
+    assert calls == []
+    assert debug["timed_out"]
+    assert debug["attempts"] == ["tesseract:back_expiry_region_1_2x_psm7:deadline"]
+
+
+def test_back_expiry_ocr_without_a_context_builds_each_variant_once(monkeypatch):
+    from collections import Counter
+    import numpy as np
+
+    monkeypatch.setattr(app, "tesseract_status", lambda: {"available": "yes"})
+    monkeypatch.setattr(app, "ocr_image_to_string", lambda image, **kwargs: "")
+    monkeypatch.setattr(app, "expiry_text_regions", lambda gray: [])
+    calls = Counter()
+    for name in ["_grayscale", "_clahe", "_otsu_threshold"]:
+        original = getattr(app, name)
+        monkeypatch.setattr(app, name, lambda image, name=name, original=original: calls.update([name]) or original(image))
+    resize = app.Image.Image.resize
+    monkeypatch.setattr(app.Image.Image, "resize", lambda pil, *args, **kwargs: calls.update(["upscale"]) or resize(pil, *args, **kwargs))
+    _, _, debug = app.detect_back_expiry_ocr(np.full((60, 80, 3), 255, dtype=np.uint8), "")
+    assert [attempt.split(":")[1] for attempt in debug["attempts"]] == [
+        "back_expiry_gray_2x_psm6", "back_expiry_clahe_2x_psm6", "back_expiry_threshold_2x_psm6", "back_expiry_sparse_2x_psm11",
+    ]
+    assert calls == {"_grayscale": 1, "upscale": 1, "_clahe": 1, "_otsu_threshold": 1}